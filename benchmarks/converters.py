@@ -0,0 +1,75 @@
+"""
+Benchmark of the name converters under many small requests
+
+Every lookup runs in its own request context like a real request, with
+a new session. Compares the query by name (what the converters did
+before) with get_by_name, which uses Session.get with the remembered
+primary key. Prints p50/p95 latency and lookups per second.
+
+python benchmarks/converters.py [--players 10000] [--lookups 20000]
+"""
+
+import argparse
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from boardgametracker import create_app, db
+from boardgametracker.models import Player
+from boardgametracker.utils import NAME_IDS, get_by_name, get_for_url
+
+
+def run(app, lookup, names):
+    """
+    Latencies in microseconds of lookup(name) in a request context each
+    """
+    latencies = []
+    for name in names:
+        with app.test_request_context():
+            start = time.perf_counter()
+            lookup(name)
+            latencies.append((time.perf_counter() - start) * 1e6)
+    return latencies
+
+
+def main():
+    """
+    p50, p95 and rate of both lookups
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--players", type=int, default=10000)
+    parser.add_argument("--lookups", type=int, default=20000)
+    args = parser.parse_args()
+
+    db_fd, db_fname = tempfile.mkstemp()
+    app = create_app({
+        "SQLALCHEMY_DATABASE_URI": "sqlite:///" + db_fname,
+        "CACHE_TYPE": "SimpleCache",
+    })
+    with app.app_context():
+        db.create_all()
+        db.session.add_all(Player(name=f"player-{i}") for i in range(args.players))
+        db.session.commit()
+
+    # most traffic goes to a few players
+    random.seed(1)
+    names = [f"player-{min(int(random.paretovariate(1)), args.players) - 1}"
+             for _ in range(args.lookups)]
+
+    NAME_IDS.clear()
+    print(f"{'lookup':14} {'p50 us':>8} {'p95 us':>8} {'lookups/s':>10}")
+    for label, lookup in (("query by name", lambda name: get_for_url(Player, "name", name)),
+                          ("get_by_name", lambda name: get_by_name(Player, name))):
+        latencies = run(app, lookup, names)
+        p95 = statistics.quantiles(latencies, n=20)[-1]
+        rate = len(latencies) / (sum(latencies) / 1e6)
+        print(f"{label:14} {statistics.median(latencies):8.1f} {p95:8.1f} {rate:10.0f}")
+
+    os.close(db_fd)
+    os.unlink(db_fname)
+
+
+if __name__ == "__main__":
+    main()
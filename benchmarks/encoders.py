@@ -0,0 +1,94 @@
+"""
+Micro-benchmark of the JSON encoders for Mason responses
+
+Encodes a MatchCollection body with 10k items, like GET /api/matches/?stream
+gives, with every encoder that is installed.
+
+python benchmarks/encoders.py [--items 10000] [--repeat 5]
+"""
+
+import argparse
+import json
+import timeit
+from datetime import datetime, timedelta
+
+from boardgametracker.utils import BGTBuilder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
+
+
+def build_body(count):
+    """
+    MatchCollection body with count items, hrefs written by hand
+    so no app is needed
+    """
+    body = BGTBuilder()
+    body.add_namespace("BGT", "/boardgametracker/link-relations/")
+    body.add_control("self", "/api/matches/")
+    body.add_control("BGT:all-players", "/api/players/", method="GET",
+                     encoding="json", title="All players")
+    body["items"] = []
+    start = datetime(2020, 1, 1)
+    for i in range(count):
+        item = BGTBuilder({
+            "id": i + 1,
+            "date": (start + timedelta(minutes=i)).isoformat(),
+            "turns": i % 40,
+            "game_name": "CS:GO",
+            "map_name": f"map-{i % 12}",
+            "ruleset_name": "competitive",
+        })
+        item.add_control("self", f"/api/match/{i + 1}/")
+        item.add_control("profile", "/profiles/match/")
+        body["items"].append(item)
+    return body
+
+
+def encoders():
+    """
+    Encoders to compare, each gives bytes like encode_json does
+    """
+    found = {
+        "json (old default)": lambda obj: json.dumps(obj).encode(),
+        "json (compact)": lambda obj: json.dumps(
+            obj, ensure_ascii=False, separators=(",", ":")).encode(),
+    }
+    if ujson is not None:
+        found["ujson"] = lambda obj: ujson.dumps(obj, ensure_ascii=False).encode()
+    if orjson is not None:
+        found["orjson"] = orjson.dumps
+    return found
+
+
+def main():
+    """
+    Time every encoder, best of the repeats
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    body = build_body(args.items)
+    print(f"{args.items} items, best of {args.repeat}")
+    results = {}
+    for name, encode in encoders().items():
+        size = len(encode(body))
+        best = min(timeit.repeat(lambda: encode(body), number=1, repeat=args.repeat))
+        results[name] = best
+        print(f"{name:20} {best * 1000:8.2f} ms  {size / 1024:8.0f} KiB")
+    baseline = results["json (old default)"]
+    print("speedup over the old json.dumps:")
+    for name, best in results.items():
+        print(f"{name:20} {baseline / best:6.1f}x")
+
+
+if __name__ == "__main__":
+    main()
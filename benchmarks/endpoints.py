@@ -0,0 +1,216 @@
+"""
+Latency benchmark of every GET route of the API
+
+Seeds a dataset of the chosen tier with testgen (kept in a file and
+reused on later runs), then GETs every route of api.py through the Flask
+test client. For each route it measures p50/p95 latency, SQL queries per
+request and the peak RSS of the process so far.
+Cache is cleared before every request unless --warm is given, so the
+numbers are for the handlers, not for the cache.
+
+Results can be saved as JSON and compared with a stored baseline,
+the exit status is 1 if the p50 of a route got slower than the tolerance
+allows or it runs more queries than before. A slower p95 is only printed.
+
+python benchmarks/endpoints.py --tier small --save results.json
+python benchmarks/endpoints.py --tier small --baseline benchmarks/baseline-small.json
+"""
+
+import argparse
+import json
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import time
+
+from flask import url_for
+from sqlalchemy import event
+
+from boardgametracker import create_app, db, cache
+from boardgametracker.models import (
+    Player, Team, Game, Map, Ruleset, Match, PlayerResult, TeamResult, generate_matches
+)
+
+# testgen sizes of each tier, results is matches * results_per_match
+TIERS = {
+    "small": dict(players=100, teams=10, games=5, maps_per_game=4,
+                  matches=250, results_per_match=4),
+    "medium": dict(players=5000, teams=200, games=20, maps_per_game=5,
+                   matches=12500, results_per_match=8),
+    "large": dict(players=50000, teams=500, games=50, maps_per_game=5,
+                  matches=125000, results_per_match=8),
+}
+
+
+def make_app(tier, seed, reseed):
+    """
+    App with the dataset of the tier, seeded if the file is not there yet
+    """
+    path = os.path.join(tempfile.gettempdir(), f"bgt-bench-{tier}-{seed}.db")
+    if reseed and os.path.exists(path):
+        os.unlink(path)
+    seeded = os.path.exists(path)
+    app = create_app({
+        "SQLALCHEMY_DATABASE_URI": "sqlite:///" + path,
+        "CACHE_TYPE": "SimpleCache",
+    })
+    with app.app_context():
+        if not seeded:
+            start = time.perf_counter()
+            db.create_all()
+            generate_matches(seed=seed, **TIERS[tier])
+            print(f"Seeded {tier} in {time.perf_counter() - start:.1f} s to {path}", file=sys.stderr)
+    return app
+
+
+def route_urls(app):
+    """
+    URL of every GET route, items are the busiest rows of the dataset
+    """
+    with app.app_context():
+        player = Player.query.order_by(Player.match_count.desc()).first()
+        team = Team.query.order_by(Team.match_count.desc()).first()
+        game = Game.query.order_by(Game.match_count.desc()).first()
+        map_ = Map.query.filter_by(game_id=game.id).order_by(Map.match_count.desc()).first()
+        ruleset = Ruleset.query.filter_by(game_id=game.id).order_by(Ruleset.match_count.desc()).first()
+        player_result = PlayerResult.query.filter_by(player_id=player.id).first()
+        match = db.session.get(Match, player_result.match_id)
+        team_result = TeamResult.query.filter_by(match_id=match.id).first()
+        values = {
+            "player": player, "team": team, "game": game, "map_": map_,
+            "ruleset": ruleset, "match": match, "player_result": player_result,
+            "team_result": team_result,
+        }
+
+        urls = {}
+        with app.test_request_context():
+            for rule in app.url_map.iter_rules():
+                if not rule.endpoint.startswith("api.") or "GET" not in rule.methods:
+                    continue
+                urls[rule.endpoint] = url_for(
+                    rule.endpoint, **{name: values[name] for name in rule.arguments}
+                )
+    return urls
+
+
+def measure(app, client, url, requests, warm):
+    """
+    Latencies in ms and queries per request of GETting url
+    """
+    statements = []
+
+    def _count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", _count)
+    latencies = []
+    try:
+        for _ in range(requests):
+            if not warm:
+                with app.app_context():
+                    cache.clear()
+            start = time.perf_counter()
+            resp = client.get(url)
+            latencies.append((time.perf_counter() - start) * 1000)
+            if resp.status_code != 200:
+                raise RuntimeError(f"GET {url} gave {resp.status_code}")
+    finally:
+        event.remove(engine, "before_cursor_execute", _count)
+    return latencies, len(statements) / requests
+
+
+def peak_rss_mb():
+    """
+    Peak resident set size of this process in MiB
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, KiB elsewhere
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+
+def compare(results, baseline, tolerance, min_delta):
+    """
+    Regressions and warnings of results against a baseline, as lines of text
+    A latency is slower if it is both tolerance and min_delta ms slower.
+    p95 of a few dozen requests is mostly one outlier, so a slower p95 only
+    warns, a slower p50 or more queries is a regression.
+    """
+    regressions = []
+    warnings = []
+    for endpoint, old in baseline["routes"].items():
+        new = results["routes"].get(endpoint)
+        if new is None:
+            continue
+        for key, found in (("p50_ms", regressions), ("p95_ms", warnings)):
+            if new[key] > old[key] * (1 + tolerance) and new[key] - old[key] > min_delta:
+                found.append(f"{endpoint}: {key} {old[key]:.2f} -> {new[key]:.2f}")
+        if new["queries"] > old["queries"]:
+            regressions.append(
+                f"{endpoint}: queries {old['queries']:g} -> {new['queries']:g}"
+            )
+    return regressions, warnings
+
+
+def main():
+    """
+    Run the routes, print a table, save and compare
+    """
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--tier", choices=TIERS, default="small")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--reseed", action="store_true", help="make the dataset again")
+    parser.add_argument("--requests", type=int, default=30, help="requests per route")
+    parser.add_argument("--warm", action="store_true", help="do not clear the cache between requests")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare with the results in this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.5,
+                        help="allowed slowdown against the baseline, 0.5 is 50%%")
+    parser.add_argument("--min-delta", type=float, default=2.0,
+                        help="slowdowns under this many ms are not regressions")
+    args = parser.parse_args()
+
+    app = make_app(args.tier, args.seed, args.reseed)
+    client = app.test_client()
+    results = {"tier": args.tier, "seed": args.seed, "requests": args.requests,
+               "warm": args.warm, "routes": {}}
+
+    print(f"{'endpoint':28} {'p50 ms':>8} {'p95 ms':>8} {'queries':>8} {'rss MiB':>8}")
+    for endpoint, url in route_urls(app).items():
+        # one request first, so imports and first connections are not measured
+        client.get(url)
+        latencies, queries = measure(app, client, url, args.requests, args.warm)
+        route = {
+            "url": url,
+            "p50_ms": statistics.median(latencies),
+            "p95_ms": statistics.quantiles(latencies, n=20)[-1],
+            "queries": queries,
+            "rss_peak_mb": peak_rss_mb(),
+        }
+        results["routes"][endpoint] = route
+        print(f"{endpoint:28} {route['p50_ms']:8.2f} {route['p95_ms']:8.2f} "
+              f"{route['queries']:8g} {route['rss_peak_mb']:8.1f}")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as handle:
+            json.dump(results, handle, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as handle:
+            baseline = json.load(handle)
+        regressions, warnings = compare(results, baseline, args.tolerance, args.min_delta)
+        for line in warnings:
+            print("WARNING " + line)
+        for line in regressions:
+            print("REGRESSION " + line)
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.baseline}")
+
+
+if __name__ == "__main__":
+    main()
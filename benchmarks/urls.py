@@ -0,0 +1,66 @@
+"""
+Benchmark of item hrefs, cost per item
+
+Builds the "self" hrefs of 50k rows with url_for (what the collection
+loops did before) and with a url_template got once before the loop.
+Rows are plain objects, the database is not touched.
+
+python benchmarks/urls.py [--rows 50000]
+"""
+
+import argparse
+import time
+from types import SimpleNamespace
+
+from flask import url_for
+
+from boardgametracker import create_app
+from boardgametracker.utils import url_template
+
+# endpoint and the models it takes, like the collection loops use them
+ROUTES = {
+    "api.matchitem": lambda i: {"match": SimpleNamespace(id=i)},
+    "api.playeritem": lambda i: {"player": SimpleNamespace(name=f"John-{i}")},
+    "api.mapitem": lambda i: {"game": SimpleNamespace(name="CS:GO"),
+                              "map_": SimpleNamespace(id=i)},
+    "api.playerresultitem": lambda i: {"match": SimpleNamespace(id=i // 10),
+                                       "player_result": SimpleNamespace(id=i)},
+}
+
+
+def per_item(func, rows):
+    """
+    Microseconds per call of func over all rows
+    """
+    start = time.perf_counter()
+    for values in rows:
+        func(values)
+    return (time.perf_counter() - start) / len(rows) * 1e6
+
+
+def main():
+    """
+    Cost per href before and after for every route
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=50000)
+    args = parser.parse_args()
+
+    app = create_app({
+        "SQLALCHEMY_DATABASE_URI": "sqlite://",
+        "CACHE_TYPE": "SimpleCache",
+    })
+    with app.test_request_context():
+        print(f"{'endpoint':22} {'url_for us':>10} {'template us':>11} {'speedup':>8}")
+        for endpoint, make in ROUTES.items():
+            rows = [make(i) for i in range(args.rows)]
+            template = url_template(endpoint, *rows[0])
+            assert all(url_for(endpoint, **values) == template(**values)
+                       for values in rows[:100])
+            before = per_item(lambda values: url_for(endpoint, **values), rows)
+            after = per_item(lambda values: template(**values), rows)
+            print(f"{endpoint:22} {before:10.2f} {after:11.2f} {before / after:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Benchmark of request validation, validations per second
+
+Compares jsonschema.validate with a new schema every time (what the
+handlers did before) with the validators built once by compile_validators.
+
+python benchmarks/validation.py [--seconds 1]
+"""
+
+import argparse
+import time
+
+from jsonschema import validate
+
+from boardgametracker.models import (
+    Player, Team, Game, Map, Ruleset, Match, PlayerResult, TeamResult
+)
+from boardgametracker.utils import compile_validators, validate_json
+
+# valid request bodies like the clients send
+PAYLOADS = {
+    Player: {"name": "John"},
+    Team: {"name": "Foxes"},
+    Game: {"name": "CS:GO"},
+    Map: {"name": "dust"},
+    Ruleset: {"name": "competitive"},
+    Match: {"date": "2022-12-25T20:00:00", "turns": 30, "game_id": 1,
+            "ruleset_id": 1, "map_id": 1},
+    PlayerResult: {"points": 23, "player_id": 1, "team_id": 2},
+    TeamResult: {"points": 56, "order": 2, "team_id": 1},
+}
+
+
+def rate(func, seconds):
+    """
+    How many times func runs in a second
+    """
+    count = 0
+    start = time.perf_counter()
+    end = start + seconds
+    while time.perf_counter() < end:
+        for _ in range(100):
+            func()
+        count += 100
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    """
+    Validations per second for each model, before and after
+    """
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--seconds", type=float, default=1.0)
+    args = parser.parse_args()
+
+    compile_validators()
+    print(f"{'model':14} {'before/s':>10} {'after/s':>10} {'speedup':>8}")
+    for model, payload in PAYLOADS.items():
+        before = rate(lambda: validate(payload, model.get_schema()), args.seconds)
+        after = rate(lambda: validate_json(payload, model), args.seconds)
+        print(f"{model.__name__:14} {before:10.0f} {after:10.0f} {after / before:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
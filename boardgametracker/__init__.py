@@ -8,13 +8,12 @@ http://flask.pocoo.org/docs/1.0/tutorial/factory/#the-application-factory
 """
 
 import os
-from flask import Response
-import json
 
 from flasgger import Swagger
 from flask import Flask
 from flask_caching import Cache
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
 
 from boardgametracker.constants import *
 
@@ -23,6 +22,26 @@ db = SQLAlchemy()
 cache = Cache()
 
 
+def set_sqlite_pragmas(app):
+    """
+    Run the PRAGMAs of SQLITE_PRAGMAS on every new SQLite connection
+    WAL lets readers go on while one connection writes
+    https://www.sqlite.org/wal.html
+    """
+    pragmas = app.config.get("SQLITE_PRAGMAS")
+    with app.app_context():
+        engine = db.engine
+    if not pragmas or engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine, "connect")
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+        cursor.close()
+
+
 def create_app(test_config=None):
     """
     Create Flask app
@@ -32,8 +51,40 @@ def create_app(test_config=None):
         SECRET_KEY="dev",
         SQLALCHEMY_DATABASE_URI="sqlite:///" + os.path.join(app.instance_path, "development.db"),
         SQLALCHEMY_TRACK_MODIFICATIONS=False,
-        CACHE_TYPE="FileSystemCache",
+        # in-memory LRU per worker in front of FileSystemCache
+        CACHE_TYPE="boardgametracker.caching.two_tier",
         CACHE_DIR=os.path.join(app.instance_path, "cache"),
+        CACHE_MEMORY_THRESHOLD=256,
+        CACHE_MEMORY_TIMEOUT=30,
+        # cached views are invalidated on write, so they can live long
+        CACHE_DEFAULT_TIMEOUT=300,
+        # items per page in paginated lists
+        PAGE_SIZE=50,
+        # set on every SQLite connection, None to use the SQLite defaults
+        SQLITE_PRAGMAS={
+            # off by default in SQLite, rows referring to missing rows
+            # give IntegrityError (409) only with this
+            "foreign_keys": "ON",
+            "journal_mode": "WAL",
+            # with WAL only a power loss can lose the last commits
+            "synchronous": "NORMAL",
+            "mmap_size": 256 * 1024 * 1024,
+            # negative is in KiB, 64 MiB of page cache per connection
+            "cache_size": -64000,
+            "temp_store": "MEMORY",
+            # wait for the writer instead of failing with "database is locked"
+            "busy_timeout": 5000,
+        },
+        # seconds until API keys are read from the database again even if
+        # the api_key table was not written through the app, see api_key_index
+        API_KEY_RELOAD=60,
+        # Server-Timing headers and /api/_stats/, see instrumentation.py
+        INSTRUMENTATION=False,
+        # statements slower than this are kept as samples in the stats
+        SLOW_QUERY_MS=100,
+        # profile every request and keep the ones slower than this many ms,
+        # None to not profile, see instrumentation.py
+        SLOW_REQUEST_PROFILE_MS=None,
     )
 
     app.config["SWAGGER"] = {
@@ -54,12 +105,14 @@ def create_app(test_config=None):
         pass
 
     db.init_app(app)
+    set_sqlite_pragmas(app)
     cache.init_app(app)
 
     # imports need to be inside the function to prevent circular imports
     # pylint gives bad points but cannot find a better way
     from . import models
     from . import api
+    from . import instrumentation
 
     from boardgametracker.utils import (
         PlayerConverter,
@@ -71,12 +124,22 @@ def create_app(test_config=None):
         PlayerResultConverter,
         TeamResultConverter,
         MasonBuilder,
-        BGTBuilder
+        BGTBuilder,
+        mason_response,
+        compile_validators
     )
 
+    # jsonschema validators are built once, not on every POST/PUT
+    compile_validators()
+
+    instrumentation.init_instrumentation(app)
+    instrumentation.init_profiler(app)
+
     # cli commands placed in models
     app.cli.add_command(models.init_db_command)
     app.cli.add_command(models.generate_test_data)
+    app.cli.add_command(models.import_command)
+    app.cli.add_command(models.recount_command)
     app.cli.add_command(models.generate_admin_key)
     # TODO: elsewhere...
     app.cli.add_command(models.generate_user_key)
@@ -113,9 +176,7 @@ def create_app(test_config=None):
         body.add_control_all_teams()
         body.add_control_all_games()
 
-        response = Response(json.dumps(body), 200, mimetype=MASON)
-
-        return response
+        return mason_response(body)
 
     @app.route("/admin/")
     def admin_page():
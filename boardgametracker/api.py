@@ -9,7 +9,7 @@ from flask_restful import Api
 
 from boardgametracker.resources.game import GameCollection, GameItem
 from boardgametracker.resources.map import MapCollection, MapItem
-from boardgametracker.resources.match import MatchCollection, MatchItem
+from boardgametracker.resources.match import MatchCollection, MatchBatchCollection, MatchItem
 from boardgametracker.resources.player import PlayerCollection, PlayerItem
 from boardgametracker.resources.player_result import PlayerResultCollection, PlayerResultItem
 from boardgametracker.resources.ruleset import RulesetCollection, RulesetItem
@@ -30,6 +30,7 @@ api.add_resource(MapItem, "/game/<game:game>/map/<map_:map_>/")
 api.add_resource(RulesetCollection, "/game/<game:game>/rulesets/")
 api.add_resource(RulesetItem, "/game/<game:game>/ruleset/<ruleset:ruleset>/")
 api.add_resource(MatchCollection, "/matches/")
+api.add_resource(MatchBatchCollection, "/matches/batch/")
 api.add_resource(MatchItem, "/match/<match:match>/")
 api.add_resource(PlayerResultCollection, "/match/<match:match>/playerresults/")
 api.add_resource(PlayerResultItem,"/match/<match:match>/playerresult/<player_result:player_result>/")
@@ -0,0 +1,164 @@
+"""
+Two tier cache for Flask-Caching
+
+A small in-memory LRU per worker in front of the shared FileSystemCache.
+Hot entries are served from memory without opening a file.
+Use with CACHE_TYPE="boardgametracker.caching.two_tier"
+
+based on cachelib's BaseCache interface
+https://cachelib.readthedocs.io/en/stable/base/
+"""
+
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from cachelib import BaseCache
+from flask_caching.backends import FileSystemCache
+
+
+class TwoTierCache(BaseCache):
+    """
+    Bounded in-memory LRU backed by another cache
+
+    Entries in memory live at most memory_timeout seconds, everything is
+    written through to the backend. Keys starting with one of the
+    bypass_prefixes are never kept in memory, they have to be the same
+    for all workers (for example the table versions of cached views).
+    Values are kept pickled, so every hit gets its own copy.
+    """
+
+    def __init__(self, backend, memory_threshold=256, memory_timeout=30,
+                 default_timeout=300, bypass_prefixes=("version/",)):
+        super().__init__(default_timeout)
+        self.backend = backend
+        self.memory_threshold = memory_threshold
+        self.memory_timeout = memory_timeout
+        self.bypass_prefixes = tuple(bypass_prefixes)
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {
+            "memory": {"hits": 0, "misses": 0},
+            "filesystem": {"hits": 0, "misses": 0},
+        }
+
+    def _in_memory(self, key):
+        """
+        Can this key be kept in memory
+        """
+        return not key.startswith(self.bypass_prefixes)
+
+    def _count(self, tier, result):
+        """
+        Add one to the hit or miss counter of a tier
+        """
+        with self._lock:
+            self._stats[tier][result] += 1
+
+    def _remember(self, key, value, timeout=None):
+        """
+        Put a value to the memory tier, drop the least recently used
+        entries if it is full
+        """
+        timeout = self._normalize_timeout(timeout)
+        if timeout == 0 or timeout > self.memory_timeout:
+            timeout = self.memory_timeout
+        entry = (time.monotonic() + timeout, pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_threshold:
+                self._memory.popitem(last=False)
+
+    def _recall(self, key):
+        """
+        Get a value from the memory tier, None if missing or expired
+        """
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            expires, data = entry
+            if expires < time.monotonic():
+                del self._memory[key]
+                return None
+            self._memory.move_to_end(key)
+        return pickle.loads(data)
+
+    def _forget(self, key):
+        """
+        Remove a key from the memory tier
+        """
+        with self._lock:
+            self._memory.pop(key, None)
+
+    def get(self, key):
+        if not self._in_memory(key):
+            return self.backend.get(key)
+
+        value = self._recall(key)
+        if value is not None:
+            self._count("memory", "hits")
+            return value
+        self._count("memory", "misses")
+
+        value = self.backend.get(key)
+        if value is None:
+            self._count("filesystem", "misses")
+            return None
+        self._count("filesystem", "hits")
+        self._remember(key, value)
+        return value
+
+    def set(self, key, value, timeout=None):
+        result = self.backend.set(key, value, timeout)
+        if self._in_memory(key):
+            if result:
+                self._remember(key, value, timeout)
+            else:
+                self._forget(key)
+        return result
+
+    def add(self, key, value, timeout=None):
+        result = self.backend.add(key, value, timeout)
+        if result and self._in_memory(key):
+            self._remember(key, value, timeout)
+        return result
+
+    def delete(self, key):
+        self._forget(key)
+        return self.backend.delete(key)
+
+    def has(self, key):
+        if self._in_memory(key) and self._recall(key) is not None:
+            return True
+        return self.backend.has(key)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        return self.backend.clear()
+
+    def stats(self):
+        """
+        Hit and miss counters of both tiers and the size of the memory tier
+        """
+        with self._lock:
+            stats = {tier: dict(counts) for tier, counts in self._stats.items()}
+            stats["memory"]["size"] = len(self._memory)
+        return stats
+
+
+def two_tier(app, config, args, kwargs):
+    """
+    Flask-Caching factory for TwoTierCache in front of FileSystemCache
+    Memory tier is set with CACHE_MEMORY_THRESHOLD and CACHE_MEMORY_TIMEOUT
+    """
+    backend = FileSystemCache.factory(app, config, args, dict(kwargs))
+    return TwoTierCache(
+        backend,
+        memory_threshold=config.get("CACHE_MEMORY_THRESHOLD", 256),
+        memory_timeout=config.get("CACHE_MEMORY_TIMEOUT", 30),
+        default_timeout=kwargs.get("default_timeout", 300),
+    )
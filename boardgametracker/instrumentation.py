@@ -0,0 +1,412 @@
+"""
+Opt-in timing of requests
+
+With INSTRUMENTATION=True every request counts its SQL queries and the
+time spent in the database, in encode_json and in total. The timings are
+sent back in a Server-Timing header and summed per endpoint, admins can
+read the sums from /api/_stats/.
+https://www.w3.org/TR/server-timing/
+
+The stats have a latency histogram per endpoint, the hit ratios of the
+cache, DB pool checkouts and samples of slow queries. They are also
+given in the Prometheus text format for scraping, ?format=prometheus
+https://prometheus.io/docs/instrumenting/exposition_formats/
+
+SQL timing is the cursor event recipe of SQLAlchemy
+https://docs.sqlalchemy.org/en/20/faq/performance.html#query-profiling
+
+Separately from those, with SLOW_REQUEST_PROFILE_MS every request is run
+under cProfile and the top frames of the ones slower than that are kept
+for admins at /api/_stats/profiles/.
+https://docs.python.org/3/library/profile.html
+"""
+
+import cProfile
+import pstats
+import threading
+import time
+from datetime import datetime, timezone
+from bisect import bisect_left
+from collections import deque
+
+from flask import Response, current_app, g, has_request_context, request
+from sqlalchemy import event
+
+from boardgametracker import db, cache
+from boardgametracker.utils import encode_json, require_admin
+
+# upper bounds in ms of the latency histogram buckets, fixed so that
+# histograms of all workers and all scrapes can be added together
+LATENCY_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# endpoint -> summed timings of its requests, see _record
+ENDPOINT_STATS = {}
+POOL_STATS = {"checkouts": 0}
+# latest statements slower than SLOW_QUERY_MS
+SLOW_QUERIES = deque(maxlen=50)
+# latest profiles of requests slower than SLOW_REQUEST_PROFILE_MS
+SLOW_PROFILES = deque(maxlen=20)
+# frames kept of each profile, by cumulative time
+PROFILE_FRAMES = 30
+_STATS_LOCK = threading.Lock()
+
+
+def reset_stats():
+    """
+    Forget everything counted so far
+    """
+    with _STATS_LOCK:
+        ENDPOINT_STATS.clear()
+        POOL_STATS["checkouts"] = 0
+        SLOW_QUERIES.clear()
+        SLOW_PROFILES.clear()
+
+
+def request_timings():
+    """
+    Timings of the current request, made on first use
+    The URL converters query before before_request is called, so the
+    request starts at whichever comes first
+    """
+    timings = g.get("timings")
+    if timings is None:
+        timings = g.timings = {
+            "start": time.perf_counter(),
+            "queries": 0,
+            "db": 0.0,
+            "serialize": 0.0,
+        }
+    return timings
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """
+    Remember when the statement started, queries of CLI commands are not timed
+    """
+    if has_request_context():
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    """
+    Add the statement to the timings of the request
+    """
+    _query_done(conn, statement)
+
+
+def _handle_error(exception_context):
+    """
+    A failed statement never gets after_cursor_execute, its start would
+    stay on the pooled connection, add it to the timings here
+    """
+    if exception_context.connection is not None and exception_context.statement is not None:
+        _query_done(exception_context.connection, exception_context.statement)
+
+
+def _query_done(conn, statement):
+    """
+    Take the start of the statement off the connection and add it to the
+    timings of the request
+    """
+    starts = conn.info.get("query_start")
+    if not starts:
+        return
+    elapsed = time.perf_counter() - starts.pop()
+    if has_request_context():
+        timings = request_timings()
+        timings["queries"] += 1
+        timings["db"] += elapsed
+        if elapsed * 1000 >= current_app.config["SLOW_QUERY_MS"]:
+            with _STATS_LOCK:
+                SLOW_QUERIES.append({
+                    "endpoint": request.endpoint,
+                    "statement": statement,
+                    "ms": elapsed * 1000,
+                })
+
+
+def _checkout(dbapi_connection, connection_record, connection_proxy):
+    """
+    Count connections taken from the pool
+    """
+    with _STATS_LOCK:
+        POOL_STATS["checkouts"] += 1
+
+
+def server_timing(timings, total):
+    """
+    Server-Timing header value of the timings, durations are in ms
+    """
+    return (
+        f'db;dur={timings["db"] * 1000:.2f};desc="{timings["queries"]} queries", '
+        f'serialize;dur={timings["serialize"] * 1000:.2f}, '
+        f"total;dur={total * 1000:.2f}"
+    )
+
+
+def _record(endpoint, timings, total):
+    """
+    Add a finished request to the sums of its endpoint
+    """
+    with _STATS_LOCK:
+        stats = ENDPOINT_STATS.get(endpoint)
+        if stats is None:
+            stats = ENDPOINT_STATS[endpoint] = {
+                "requests": 0,
+                "queries": 0,
+                "max_queries": 0,
+                "db": 0.0,
+                "serialize": 0.0,
+                "total": 0.0,
+                # the last one is for requests slower than every bucket
+                "buckets": [0] * (len(LATENCY_BUCKETS_MS) + 1),
+            }
+        stats["requests"] += 1
+        stats["queries"] += timings["queries"]
+        stats["max_queries"] = max(stats["max_queries"], timings["queries"])
+        stats["db"] += timings["db"]
+        stats["serialize"] += timings["serialize"]
+        stats["total"] += total
+        stats["buckets"][bisect_left(LATENCY_BUCKETS_MS, total * 1000)] += 1
+
+
+def _endpoint_sums():
+    """
+    Copy of ENDPOINT_STATS
+    """
+    with _STATS_LOCK:
+        return {
+            endpoint: dict(stats, buckets=list(stats["buckets"]))
+            for endpoint, stats in ENDPOINT_STATS.items()
+        }
+
+
+def endpoint_stats():
+    """
+    Averages per request of every endpoint seen, times in ms, and the
+    request counts of the LATENCY_BUCKETS_MS buckets
+    """
+    sums = _endpoint_sums()
+    return {
+        endpoint: {
+            "requests": stats["requests"],
+            "queries": stats["queries"] / stats["requests"],
+            "max_queries": stats["max_queries"],
+            "db_ms": stats["db"] / stats["requests"] * 1000,
+            "serialize_ms": stats["serialize"] / stats["requests"] * 1000,
+            "total_ms": stats["total"] / stats["requests"] * 1000,
+            "latency_buckets": stats["buckets"],
+        }
+        for endpoint, stats in sorted(sums.items())
+    }
+
+
+def cache_stats():
+    """
+    Hits, misses and hit ratio of each tier of the cache
+    None if the cache backend does not count them
+    """
+    backend = getattr(cache, "cache", None)
+    if not hasattr(backend, "stats"):
+        return None
+    stats = backend.stats()
+    for counts in stats.values():
+        lookups = counts["hits"] + counts["misses"]
+        counts["hit_ratio"] = counts["hits"] / lookups if lookups else None
+    return stats
+
+
+def pool_stats():
+    """
+    Checkouts so far and connections out of the pool now
+    """
+    checked_out = getattr(db.engine.pool, "checkedout", None)
+    with _STATS_LOCK:
+        checkouts = POOL_STATS["checkouts"]
+    return {
+        "checkouts": checkouts,
+        "checked_out": checked_out() if checked_out is not None else None,
+    }
+
+
+def prometheus_text():
+    """
+    All stats except the slow queries in the Prometheus text format
+    Times are in seconds like Prometheus wants them
+    """
+    lines = [
+        "# HELP bgt_request_duration_seconds Time from routing to after_request",
+        "# TYPE bgt_request_duration_seconds histogram",
+    ]
+    sums = _endpoint_sums()
+    for endpoint, stats in sorted(sums.items()):
+        label = f'endpoint="{endpoint}"'
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS_MS + ("+Inf",), stats["buckets"]):
+            cumulative += count
+            le = bound if bound == "+Inf" else f"{bound / 1000:g}"
+            lines.append(f'bgt_request_duration_seconds_bucket{{{label},le="{le}"}} {cumulative}')
+        lines.append(f"bgt_request_duration_seconds_sum{{{label}}} {stats['total']:.6f}")
+        lines.append(f"bgt_request_duration_seconds_count{{{label}}} {stats['requests']}")
+
+    for name, key, help_text in (
+        ("bgt_db_queries_total", "queries", "SQL statements run"),
+        ("bgt_db_seconds_total", "db", "Time spent in SQL statements"),
+        ("bgt_serialize_seconds_total", "serialize", "Time spent in encode_json"),
+    ):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} counter")
+        for endpoint, stats in sorted(sums.items()):
+            lines.append(f'{name}{{endpoint="{endpoint}"}} {stats[key]:g}')
+
+    caches = cache_stats()
+    if caches is not None:
+        for result in ("hits", "misses"):
+            lines.append(f"# TYPE bgt_cache_{result}_total counter")
+            for tier, counts in caches.items():
+                lines.append(f'bgt_cache_{result}_total{{tier="{tier}"}} {counts[result]}')
+
+    pool = pool_stats()
+    lines.append("# TYPE bgt_db_pool_checkouts_total counter")
+    lines.append(f"bgt_db_pool_checkouts_total {pool['checkouts']}")
+    if pool["checked_out"] is not None:
+        lines.append("# TYPE bgt_db_pool_checked_out gauge")
+        lines.append(f"bgt_db_pool_checked_out {pool['checked_out']}")
+    return "\n".join(lines) + "\n"
+
+
+def _start_request():
+    """
+    before_request hook
+    """
+    request_timings()
+
+
+def _finish_request(response):
+    """
+    after_request hook, streamed bodies are encoded after this, their
+    serialization time is not counted
+    """
+    timings = request_timings()
+    total = time.perf_counter() - timings["start"]
+    response.headers.add("Server-Timing", server_timing(timings, total))
+    if request.endpoint is not None:
+        _record(request.endpoint, timings, total)
+    return response
+
+
+@require_admin
+def stats_view():
+    """
+    Stats of this worker since it started, as JSON or with
+    ?format=prometheus in the Prometheus text format
+    """
+    if request.args.get("format") == "prometheus":
+        return Response(prometheus_text(), 200, content_type="text/plain; version=0.0.4")
+    with _STATS_LOCK:
+        slow_queries = list(SLOW_QUERIES)
+    body = {
+        "latency_buckets_ms": LATENCY_BUCKETS_MS,
+        "endpoints": endpoint_stats(),
+        "cache": cache_stats(),
+        "db_pool": pool_stats(),
+        "slow_queries": slow_queries,
+    }
+    return Response(encode_json(body), 200, mimetype="application/json")
+
+
+def _start_profile():
+    """
+    before_request hook, profile the request
+    Only one profiler can run at a time on Python 3.12 and newer, if
+    another request has it this one is not profiled
+    """
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError:
+        return
+    g.profile = profile
+    g.profile_start = time.perf_counter()
+
+
+def top_frames(profile, limit=PROFILE_FRAMES):
+    """
+    Functions of a finished profile with the most cumulative time
+    """
+    stats = pstats.Stats(profile).stats
+    frames = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+    return [
+        {
+            "function": pstats.func_std_string(func),
+            "calls": calls,
+            "own_ms": own * 1000,
+            "cumulative_ms": cumulative * 1000,
+        }
+        for func, (primitive, calls, own, cumulative, callers) in frames
+    ]
+
+
+def _finish_profile(exc):
+    """
+    teardown_request hook, keep the profile if the request was slow
+    """
+    profile = g.pop("profile", None)
+    if profile is None:
+        return
+    profile.disable()
+    elapsed = (time.perf_counter() - g.profile_start) * 1000
+    if elapsed < current_app.config["SLOW_REQUEST_PROFILE_MS"]:
+        return
+    entry = {
+        "endpoint": request.endpoint,
+        "method": request.method,
+        "path": request.full_path,
+        "ms": elapsed,
+        "time": datetime.now(timezone.utc).isoformat(),
+        "frames": top_frames(profile),
+    }
+    with _STATS_LOCK:
+        SLOW_PROFILES.append(entry)
+
+
+@require_admin
+def profiles_view():
+    """
+    Kept profiles of slow requests as a JSON file, oldest first
+    """
+    with _STATS_LOCK:
+        profiles = list(SLOW_PROFILES)
+    response = Response(encode_json({"profiles": profiles}), 200, mimetype="application/json")
+    response.headers["Content-Disposition"] = "attachment; filename=slow-requests.json"
+    return response
+
+
+def init_profiler(app):
+    """
+    Profile requests if SLOW_REQUEST_PROFILE_MS is set, and add the
+    endpoint for the profiles
+    """
+    if app.config.get("SLOW_REQUEST_PROFILE_MS") is None:
+        return
+    app.before_request(_start_profile)
+    app.teardown_request(_finish_profile)
+    app.add_url_rule("/api/_stats/profiles/", "profiles", profiles_view)
+
+
+def init_instrumentation(app):
+    """
+    Hook the timings to the engine and the requests of the app if
+    INSTRUMENTATION is set, and add the stats endpoint
+    """
+    if not app.config.get("INSTRUMENTATION"):
+        return
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+    event.listen(engine, "checkout", _checkout)
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.add_url_rule("/api/_stats/", "stats", stats_view)
@@ -7,12 +7,20 @@ from sensorhub example
 https://github.com/enkwolf/pwp-course-sensorhub-api-example/blob/master/sensorhub/models.py
 """
 
+import csv
 import datetime
+import json
+import random
 import click
 import hashlib
+from collections import Counter
 
 
 from flask.cli import with_appcontext
+from sqlalchemy import bindparam, event, inspect, select, func, text, update
+from sqlalchemy.schema import CreateColumn
+from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.orm.attributes import get_history
 
 from boardgametracker import db
 
@@ -23,9 +31,9 @@ class ApiKey(db.Model):
     """
     name = db.Column(db.String(16), primary_key=True)
     key = db.Column(db.String(32), nullable=False, unique=True)
-    admin = db.Column(db.Boolean, default=False)
+    admin = db.Column(db.Boolean, default=False, index=True)
 
-    player_id = db.Column(db.Integer, db.ForeignKey("player.id"), nullable=True)
+    player_id = db.Column(db.Integer, db.ForeignKey("player.id"), nullable=True, index=True)
 
     @staticmethod
     def key_hash(key):
@@ -36,6 +44,8 @@ class Player(db.Model):
     """
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(16), unique=True, nullable=False)
+    # kept up to date on write, see MATCH_COUNTERS
+    match_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
 
     # results by player
     player_result = db.relationship("PlayerResult", back_populates="player")
@@ -54,7 +64,7 @@ class Player(db.Model):
         return {
             "name": self.name,
             "id": self.id,
-            "matches": len(self.player_result)
+            "matches": self.match_count
         }
 
     @staticmethod
@@ -80,6 +90,8 @@ class Team(db.Model):
     """
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(16), unique=True, nullable=False)
+    # kept up to date on write, see MATCH_COUNTERS
+    match_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
 
     # result - team relation
     team_result = db.relationship("TeamResult", back_populates="team")
@@ -97,7 +109,7 @@ class Team(db.Model):
         return {
             "name": self.name,
             "id": self.id,
-            "matches": len(self.team_result)
+            "matches": self.match_count
         }
 
     @staticmethod
@@ -123,6 +135,8 @@ class Game(db.Model):
     """
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(16), unique=True, nullable=False)
+    # kept up to date on write, see MATCH_COUNTERS
+    match_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
 
     # map - game relationship
     map = db.relationship("Map", back_populates="game")
@@ -142,7 +156,7 @@ class Game(db.Model):
         return {
             "name": self.name,
             "id": self.id,
-            "matches": len(self.match)
+            "matches": self.match_count
         }
 
     @staticmethod
@@ -170,10 +184,13 @@ class Map(db.Model):
     # different games might have same names for maps
     # removed uniqueness
     name = db.Column(db.String(16), nullable=False)
+    # kept up to date on write, see MATCH_COUNTERS
+    match_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
 
     game_id = db.Column(
         db.Integer,
-        db.ForeignKey("game.id", ondelete="SET NULL")
+        db.ForeignKey("game.id", ondelete="SET NULL"),
+        index=True
     )
 
     # map - game relationship
@@ -182,6 +199,13 @@ class Map(db.Model):
     # match - map relationship
     match = db.relationship("Match", back_populates="map")
 
+    @staticmethod
+    def eager_query():
+        """
+        Query for lists, joins the game used in serialize(long=True)
+        """
+        return Map.query.options(joinedload(Map.game))
+
     def serialize(self, long=False):
         """
         Convert data to dictionary format
@@ -197,7 +221,7 @@ class Map(db.Model):
             "name": self.name,
             "id": self.id,
             "game": self.game.serialize()["name"],
-            "matches": len(self.match)
+            "matches": self.match_count
         }
 
     @staticmethod
@@ -223,16 +247,26 @@ class Ruleset(db.Model):
     """
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(16), nullable=False)
+    # kept up to date on write, see MATCH_COUNTERS
+    match_count = db.Column(db.Integer, nullable=False, default=0, server_default="0")
 
     game_id = db.Column(
         db.Integer,
-        db.ForeignKey("game.id", ondelete="SET NULL")
+        db.ForeignKey("game.id", ondelete="SET NULL"),
+        index=True
     )
 
     # ruleset - game relationship
     game = db.relationship("Game", back_populates="ruleset")
     match = db.relationship("Match", back_populates="ruleset")
 
+    @staticmethod
+    def eager_query():
+        """
+        Query for lists, joins the game used in serialize(long=True)
+        """
+        return Ruleset.query.options(joinedload(Ruleset.game))
+
     def serialize(self, long=False):
         """
         Convert data to dictionary format
@@ -245,7 +279,7 @@ class Ruleset(db.Model):
             "name": self.name,
             "id": self.id,
             "game": self.game.serialize()["name"],
-            "matches": len(self.match)
+            "matches": self.match_count
         }
 
     @staticmethod
@@ -270,20 +304,24 @@ class Match(db.Model):
     Match class
     """
     id = db.Column(db.Integer, primary_key=True)
-    date = db.Column(db.DateTime, nullable=False)
+    # pages are ordered by (date, id), in SQLite the index holds the id too
+    date = db.Column(db.DateTime, nullable=False, index=True)
     turns = db.Column(db.Integer, nullable=False)
 
     game_id = db.Column(
         db.Integer,
-        db.ForeignKey("game.id", ondelete="SET NULL")
+        db.ForeignKey("game.id", ondelete="SET NULL"),
+        index=True
     )
     ruleset_id = db.Column(
         db.Integer,
-        db.ForeignKey("ruleset.id", ondelete="SET NULL")
+        db.ForeignKey("ruleset.id", ondelete="SET NULL"),
+        index=True
     )
     map_id = db.Column(
         db.Integer,
-        db.ForeignKey("map.id", ondelete="SET NULL")
+        db.ForeignKey("map.id", ondelete="SET NULL"),
+        index=True
     )
 
     game = db.relationship("Game", back_populates="match")
@@ -292,6 +330,30 @@ class Match(db.Model):
     team_result = db.relationship("TeamResult", back_populates="match")
     player_result = db.relationship("PlayerResult", back_populates="match")
 
+    @staticmethod
+    def eager_query():
+        """
+        Query for lists, joins game, map and ruleset to the same SELECT
+        so serialize(long=True) does not lazy load them one by one
+        """
+        return Match.query.options(
+            joinedload(Match.game),
+            joinedload(Match.map),
+            joinedload(Match.ruleset)
+        )
+
+    @staticmethod
+    def stream_query():
+        """
+        Query for streaming with yield_per, which cannot be used with
+        joinedload. Game, map and ruleset are loaded once per batch instead
+        """
+        return Match.query.options(
+            selectinload(Match.game),
+            selectinload(Match.map),
+            selectinload(Match.ruleset)
+        )
+
     def serialize(self, long=False):
         """
         Convert data to dictionary format
@@ -355,15 +417,18 @@ class PlayerResult(db.Model):
 
     match_id = db.Column(
         db.Integer,
-        db.ForeignKey("match.id", ondelete="CASCADE")
+        db.ForeignKey("match.id", ondelete="CASCADE"),
+        index=True
     )
     player_id = db.Column(
         db.Integer,
-        db.ForeignKey("player.id", ondelete="SET NULL")
+        db.ForeignKey("player.id", ondelete="SET NULL"),
+        index=True
     )
     team_id = db.Column(
         db.Integer,
-        db.ForeignKey("team.id", ondelete="SET NULL")
+        db.ForeignKey("team.id", ondelete="SET NULL"),
+        index=True
     )
 
     # result - player relation
@@ -373,6 +438,16 @@ class PlayerResult(db.Model):
     # team relation
     team = db.relationship("Team", back_populates="match_player")
 
+    @staticmethod
+    def eager_query():
+        """
+        Query for lists, joins player and team to the same SELECT
+        """
+        return PlayerResult.query.options(
+            joinedload(PlayerResult.player),
+            joinedload(PlayerResult.team)
+        )
+
     def serialize(self, long=False):
         """
         Convert data to dictionary format
@@ -435,11 +510,13 @@ class TeamResult(db.Model):
 
     match_id = db.Column(
         db.Integer,
-        db.ForeignKey("match.id", ondelete="CASCADE")
+        db.ForeignKey("match.id", ondelete="CASCADE"),
+        index=True
     )
     team_id = db.Column(
         db.Integer,
-        db.ForeignKey("team.id", ondelete="SET NULL")
+        db.ForeignKey("team.id", ondelete="SET NULL"),
+        index=True
     )
 
     # result - team relation
@@ -447,6 +524,13 @@ class TeamResult(db.Model):
     # result - match relation
     match = db.relationship("Match", back_populates="team_result")
 
+    @staticmethod
+    def eager_query():
+        """
+        Query for lists, joins team to the same SELECT
+        """
+        return TeamResult.query.options(joinedload(TeamResult.team))
+
     def serialize(self, long=False):
         """
         Convert data to dictionary format
@@ -497,6 +581,178 @@ class TeamResult(db.Model):
         return schema
 
 
+class MatchBatch:
+    """
+    Matches with their player and team results in one POST
+    Not a table, only the schema for the batch endpoint
+    """
+
+    @staticmethod
+    def get_schema():
+        """
+        json verification
+        One match or a list of them, results go inside their match
+        """
+        match = Match.get_schema()
+        match["required"] = ["date", "turns"]
+        props = match["properties"]
+        props["player_results"] = {
+            "description": "Rows of player results",
+            "type": "array",
+            "items": PlayerResult.get_schema()
+        }
+        team_result = TeamResult.get_schema()
+        team_result["required"] = ["points", "order", "team_id"]
+        props["team_results"] = {
+            "description": "Rows of team results",
+            "type": "array",
+            "items": team_result
+        }
+        return {
+            "oneOf": [
+                match,
+                {"type": "array", "items": match, "minItems": 1}
+            ]
+        }
+
+
+# match counters
+# match_count columns are kept up to date on write, so reading them is
+# free. (child model, foreign key, counted model)
+MATCH_COUNTERS = [
+    (PlayerResult, "player_id", Player),
+    (TeamResult, "team_id", Team),
+    (Match, "game_id", Game),
+    (Match, "map_id", Map),
+    (Match, "ruleset_id", Ruleset),
+]
+
+
+def _adjust_match_count(connection, model, row_id, amount):
+    """
+    Add amount to match_count of one row, in SQL so it is safe with
+    concurrent writers
+    """
+    if row_id is None:
+        return
+    table = model.__table__
+    connection.execute(
+        update(table)
+        .where(table.c.id == row_id)
+        .values(match_count=table.c.match_count + amount)
+    )
+
+
+def _count_insert(mapper, connection, target):
+    """
+    New row counts for its parents
+    """
+    for child, column, model in MATCH_COUNTERS:
+        if isinstance(target, child):
+            _adjust_match_count(connection, model, getattr(target, column), 1)
+
+
+def _count_delete(mapper, connection, target):
+    """
+    Deleted row does not count anymore
+    """
+    for child, column, model in MATCH_COUNTERS:
+        if isinstance(target, child):
+            _adjust_match_count(connection, model, getattr(target, column), -1)
+
+
+def _count_update(mapper, connection, target):
+    """
+    Moving a row from a parent to another moves the count too
+    """
+    for child, column, model in MATCH_COUNTERS:
+        if isinstance(target, child):
+            history = get_history(target, column)
+            if not history.has_changes():
+                continue
+            for old_id in history.deleted:
+                _adjust_match_count(connection, model, old_id, -1)
+            for new_id in history.added:
+                _adjust_match_count(connection, model, new_id, 1)
+
+
+for counted in (PlayerResult, TeamResult, Match):
+    event.listen(counted, "after_insert", _count_insert)
+    event.listen(counted, "after_update", _count_update)
+    event.listen(counted, "after_delete", _count_delete)
+
+
+def add_match_counts(child, rows):
+    """
+    Count rows of child inserted in bulk, the mapper events do not see them
+    rows are the dicts given to the INSERT, one executemany UPDATE per counter
+    """
+    for counted, column, model in MATCH_COUNTERS:
+        if counted is not child:
+            continue
+        counts = Counter(row[column] for row in rows if row.get(column) is not None)
+        if not counts:
+            continue
+        table = model.__table__
+        db.session.execute(
+            update(table)
+            .where(table.c.id == bindparam("row_id"))
+            .values(match_count=table.c.match_count + bindparam("amount")),
+            [{"row_id": row_id, "amount": amount} for row_id, amount in counts.items()]
+        )
+
+
+def recount_matches():
+    """
+    Rebuild all match_count columns from the child tables
+    One UPDATE per counter, cached views of the counted tables are dropped
+    """
+    from boardgametracker.utils import mark_tables_changed
+
+    for child, column, model in MATCH_COUNTERS:
+        child_table = child.__table__
+        table = model.__table__
+        db.session.execute(
+            update(table).values(
+                match_count=select(func.count())
+                .select_from(child_table)
+                .where(child_table.c[column] == table.c.id)
+                .scalar_subquery()
+            )
+        )
+        mark_tables_changed(table.name)
+    db.session.commit()
+
+
+def upgrade_db():
+    """
+    Bring a database made by an older version up to the models
+    create_all makes only missing tables, this also adds missing columns
+    and indexes to the existing ones. Match counters are rebuilt if
+    their columns were added.
+    Returns the names of the added columns and indexes
+    """
+    db.create_all()
+    inspector = inspect(db.engine)
+    added = []
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            columns = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in columns:
+                    ddl = CreateColumn(column).compile(dialect=connection.dialect)
+                    connection.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {ddl}"))
+                    added.append(f"{table.name}.{column.name}")
+            indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indexes:
+                    index.create(connection)
+                    added.append(index.name)
+    if any(name.endswith(".match_count") for name in added):
+        recount_matches()
+    return added
+
+
 # commands for cli
 # placed here to ensure that the models are loaded.
 # call them from __init__.py
@@ -507,20 +763,164 @@ class TeamResult(db.Model):
 
 
 @click.command("init-db")
+@click.option("--upgrade", is_flag=True,
+              help="Also add missing columns and indexes to existing tables")
 @with_appcontext
-def init_db_command():
+def init_db_command(upgrade):
     """
     Create the database
     """
-    db.create_all()
+    if not upgrade:
+        db.create_all()
+        return
+    for name in upgrade_db():
+        print(f"Added {name}")
+
+
+def _zipf_weights(count, exponent=1.1):
+    """
+    Cumulative weights for random.choices where the n:th item is picked
+    about 1/n**exponent as often as the first, like real activity
+    """
+    total = 0.0
+    weights = []
+    for rank in range(1, count + 1):
+        total += 1 / rank ** exponent
+        weights.append(total)
+    return weights
+
+
+def _add_named_rows(model, count, prefix, **columns):
+    """
+    Insert count rows named prefix-<id> with one executemany
+    columns are functions of the index giving the other column values
+    Returns the new ids
+    """
+    first = (db.session.scalar(select(func.max(model.id))) or 0) + 1
+    ids = list(range(first, first + count))
+    rows = [
+        dict({"id": id_, "name": f"{prefix}-{id_}"},
+             **{column: value(index) for column, value in columns.items()})
+        for index, id_ in enumerate(ids)
+    ]
+    if rows:
+        _insert_many(model.__table__, rows)
+    return ids
+
+
+def generate_matches(players, teams, games, maps_per_game, matches,
+                     results_per_match, seed=None, batch_size=10000):
+    """
+    Add a random but repeatable (with seed) data set of any size
+
+    Player activity and game popularity follow a power law, every game
+    has a varying number of maps and rulesets with their own popularity.
+    Every match has two teams, results_per_match player results and a
+    team result for both teams. Rows are written with executemany
+    batch_size results at a time.
+    """
+    from boardgametracker.utils import mark_tables_changed
+
+    rand = random.Random(seed)
+
+    player_ids = _add_named_rows(Player, players, "player")
+    team_ids = _add_named_rows(Team, teams, "team")
+    game_ids = _add_named_rows(Game, games, "game")
+    rand.shuffle(player_ids)
+    game_maps = {}
+    game_rulesets = {}
+    for game_id in game_ids:
+        map_ids = _add_named_rows(Map, rand.randint(1, 2 * maps_per_game - 1), "map",
+                                  game_id=lambda index: game_id)
+        ruleset_ids = _add_named_rows(Ruleset, rand.randint(1, 3), "ruleset",
+                                      game_id=lambda index: game_id)
+        game_maps[game_id] = (map_ids, _zipf_weights(len(map_ids)))
+        game_rulesets[game_id] = (ruleset_ids, _zipf_weights(len(ruleset_ids)))
+    mark_tables_changed("player", "team", "game", "map", "ruleset")
+    db.session.commit()
+
+    # flatter than games, the most active player is not in every match
+    player_weights = _zipf_weights(len(player_ids), exponent=0.8)
+    game_weights = _zipf_weights(len(game_ids))
+    next_match_id = (db.session.scalar(select(func.max(Match.id))) or 0) + 1
+    start = datetime.datetime(2020, 1, 1)
+    match_rows, player_rows, team_rows = [], [], []
+
+    for match_id in range(next_match_id, next_match_id + matches):
+        game_id = rand.choices(game_ids, cum_weights=game_weights)[0]
+        map_ids, map_weights = game_maps[game_id]
+        ruleset_ids, ruleset_weights = game_rulesets[game_id]
+        match_rows.append({
+            "id": match_id,
+            "date": start + datetime.timedelta(minutes=rand.randrange(3 * 365 * 24 * 60)),
+            "turns": rand.randint(1, 60),
+            "game_id": game_id,
+            "map_id": rand.choices(map_ids, cum_weights=map_weights)[0],
+            "ruleset_id": rand.choices(ruleset_ids, cum_weights=ruleset_weights)[0],
+        })
+
+        # the same player only once in a match
+        picked = rand.choices(player_ids, cum_weights=player_weights, k=2 * results_per_match)
+        match_players = list(dict.fromkeys(picked))[:results_per_match]
+        while len(match_players) < min(results_per_match, len(player_ids)):
+            player_id = rand.choice(player_ids)
+            if player_id not in match_players:
+                match_players.append(player_id)
+        match_teams = rand.sample(team_ids, 2) if len(team_ids) >= 2 else team_ids
+        for index, player_id in enumerate(match_players):
+            player_rows.append({
+                "points": max(0, round(rand.gauss(20, 8))),
+                "match_id": match_id,
+                "player_id": player_id,
+                "team_id": match_teams[index % len(match_teams)] if match_teams else None,
+            })
+        for order, team_id in enumerate(match_teams, 1):
+            team_rows.append({
+                "points": max(0, round(rand.gauss(50, 15))),
+                "order": order,
+                "match_id": match_id,
+                "team_id": team_id,
+            })
+
+        if len(player_rows) + len(team_rows) >= batch_size:
+            _write_match_batch(match_rows, player_rows, team_rows, count=False)
+
+    _write_match_batch(match_rows, player_rows, team_rows, count=False)
+    # most players are in most batches, counting once at the end is cheaper
+    recount_matches()
 
 
 @click.command("testgen")
+@click.option("--players", type=click.IntRange(min=1),
+              help="Players to add, any size option makes a random data set")
+@click.option("--teams", type=click.IntRange(min=0), help="Teams to add")
+@click.option("--games", type=click.IntRange(min=1), help="Games to add")
+@click.option("--maps-per-game", type=click.IntRange(min=1), help="Average maps of a game")
+@click.option("--matches", type=click.IntRange(min=0), help="Matches to add")
+@click.option("--results-per-match", type=click.IntRange(min=0), help="Player results in a match")
+@click.option("--seed", type=int, help="Seed for a repeatable data set")
 @with_appcontext
-def generate_test_data():
+def generate_test_data(players, teams, games, maps_per_game, matches, results_per_match, seed):
     """
     Populate the database with some example data
+    Without options adds one of everything, with size options a random
+    data set of that size (missing sizes use the defaults below)
     """
+    sizes = (players, teams, games, maps_per_game, matches, results_per_match)
+    if any(size is not None for size in sizes):
+        generate_matches(
+            players=1000 if players is None else players,
+            teams=50 if teams is None else teams,
+            games=10 if games is None else games,
+            maps_per_game=5 if maps_per_game is None else maps_per_game,
+            matches=10000 if matches is None else matches,
+            results_per_match=4 if results_per_match is None else results_per_match,
+            seed=seed,
+        )
+        print(f"Added {db.session.scalar(select(func.count(Match.id)))} matches "
+              f"and {db.session.scalar(select(func.count(PlayerResult.id)))} player results in total")
+        return
+
     # Populate database
 
     # add a player
@@ -605,6 +1005,207 @@ def generate_test_data():
     db.session.commit()
 
 
+# columns of an import file, one row per player or team result
+IMPORT_FIELDS = ["match", "date", "turns", "game", "map", "ruleset", "player", "team", "points", "order"]
+
+
+def _read_import_rows(stream, file_format):
+    """
+    Line numbers and rows of a CSV or NDJSON file as dicts, one at a time
+    Raises ClickException on a line that cannot be parsed
+    """
+    if file_format == "csv":
+        reader = csv.DictReader(stream)
+        try:
+            for row in reader:
+                yield reader.line_num, row
+        except csv.Error as err:
+            raise click.ClickException(f"Line {reader.line_num}: {err!r}")
+        return
+    for line_number, line in enumerate(stream, 1):
+        if line.strip():
+            try:
+                row = json.loads(line)
+            except ValueError as err:
+                raise click.ClickException(f"Line {line_number}: {err!r}")
+            yield line_number, row
+
+
+class _NameIds(dict):
+    """
+    name -> id of one table, rows missing from the database are added
+    key_columns are the columns of the key, ("name",) or ("game_id", "name")
+    """
+
+    def __init__(self, model, key_columns=("name",)):
+        super().__init__()
+        self.table = model.__table__
+        self.key_columns = key_columns
+        columns = [self.table.c[column] for column in key_columns]
+        for row in db.session.execute(select(self.table.c.id, *columns)):
+            self[tuple(row[1:]) if len(key_columns) > 1 else row[1]] = row[0]
+
+    def __missing__(self, key):
+        values = dict(zip(self.key_columns, key if len(self.key_columns) > 1 else (key,)))
+        result = db.session.execute(self.table.insert().values(**values))
+        self[key] = result.inserted_primary_key[0]
+        return self[key]
+
+
+def _insert_many(table, rows):
+    """
+    executemany INSERT of dict rows (all with the same keys) straight on
+    the DB-API cursor. SQLAlchemy's parameter handling per row would cost
+    more than the INSERT, only the type conversions (dates) are kept.
+    """
+    connection = db.session.connection()
+    dialect = connection.dialect
+    # python side defaults (like match_count=0) are not filled in for us
+    defaults = {
+        column.key: column.default.arg for column in table.c
+        if column.key not in rows[0] and column.default is not None and column.default.is_scalar
+    }
+    if defaults:
+        rows = [dict(defaults, **row) for row in rows]
+    keys = list(rows[0])
+    compiled = table.insert().compile(dialect=dialect, column_keys=keys)
+    processors = {
+        key: processor for key in keys
+        if (processor := table.c[key].type.dialect_impl(dialect).bind_processor(dialect)) is not None
+    }
+    if processors:
+        rows = [
+            {key: processors[key](value) if key in processors else value
+             for key, value in row.items()}
+            for row in rows
+        ]
+    if compiled.positional:
+        rows = [tuple(row[key] for key in compiled.positiontup) for row in rows]
+    connection.exec_driver_sql(str(compiled), rows)
+
+
+def _write_match_batch(match_rows, player_rows, team_rows, count=True):
+    """
+    Insert rows of matches and results with one executemany per table,
+    update the counters and commit. The lists are emptied.
+    With count=False the caller runs recount_matches at the end instead
+    """
+    from boardgametracker.utils import mark_tables_changed
+
+    for model, rows in ((Match, match_rows), (PlayerResult, player_rows), (TeamResult, team_rows)):
+        if rows:
+            _insert_many(model.__table__, rows)
+            if count:
+                add_match_counts(model, rows)
+            rows.clear()
+    mark_tables_changed("match", "player_result", "team_result",
+                        "player", "team", "game", "map", "ruleset")
+    db.session.commit()
+
+
+def import_results(stream, file_format, batch_size=10000):
+    """
+    Import match histories from a CSV or NDJSON stream
+
+    Every row is a player result (player set) or a team result (player
+    empty). Rows with the same match key in a row belong to one match,
+    date, turns, game, map and ruleset are read from its first row.
+    Names are resolved from dicts loaded once and missing players, teams,
+    games, maps and rulesets are added. Rows are inserted with executemany
+    batch_size results at a time, so memory does not grow with the file.
+    Every batch is committed, a bad line raises ClickException and only
+    the batch it is in is rolled back.
+    Returns (matches, results) added
+    """
+    players = _NameIds(Player)
+    teams = _NameIds(Team)
+    games = _NameIds(Game)
+    maps = _NameIds(Map, ("game_id", "name"))
+    rulesets = _NameIds(Ruleset, ("game_id", "name"))
+    next_match_id = (db.session.scalar(select(func.max(Match.id))) or 0) + 1
+
+    match_rows, player_rows, team_rows = [], [], []
+    match_count = result_count = 0
+    current_match = None
+
+    try:
+        for line_number, row in _read_import_rows(stream, file_format):
+            try:
+                if row["match"] != current_match:
+                    current_match = row["match"]
+                    game_id = games[row["game"]] if row.get("game") else None
+                    match_rows.append({
+                        "id": next_match_id,
+                        "date": datetime.datetime.fromisoformat(row["date"]),
+                        "turns": int(row["turns"]),
+                        "game_id": game_id,
+                        "map_id": maps[game_id, row["map"]] if row.get("map") else None,
+                        "ruleset_id": rulesets[game_id, row["ruleset"]] if row.get("ruleset") else None,
+                    })
+                    next_match_id += 1
+                    match_count += 1
+
+                team_id = teams[row["team"]] if row.get("team") else None
+                if row.get("player"):
+                    player_rows.append({
+                        "points": float(row["points"]),
+                        "match_id": next_match_id - 1,
+                        "player_id": players[row["player"]],
+                        "team_id": team_id,
+                    })
+                else:
+                    team_rows.append({
+                        "points": float(row["points"]),
+                        "order": int(row["order"]),
+                        "match_id": next_match_id - 1,
+                        "team_id": team_id,
+                    })
+            except (KeyError, TypeError, ValueError) as err:
+                raise click.ClickException(f"Line {line_number}: {err!r}")
+
+            result_count += 1
+            if len(player_rows) + len(team_rows) >= batch_size:
+                _write_match_batch(match_rows, player_rows, team_rows)
+    except click.ClickException:
+        # only the batch being built, written batches stay
+        db.session.rollback()
+        raise
+
+    _write_match_batch(match_rows, player_rows, team_rows)
+    return match_count, result_count
+
+
+@click.command("import")
+@click.argument("source", type=click.File("r", encoding="utf-8"))
+@click.option("--format", "file_format", type=click.Choice(["csv", "ndjson"]),
+              help="Format of the file, guessed from the file name if not given")
+@click.option("--batch-size", default=10000, show_default=True,
+              help="Results written with one executemany")
+@with_appcontext
+def import_command(source, file_format, batch_size):
+    """
+    Import match histories from a CSV or NDJSON file (- for stdin)
+    Columns: match, date, turns, game, map, ruleset, player, team, points, order
+
+    Results are committed every --batch-size rows. A bad line stops the
+    import, but the batches before it stay imported.
+    """
+    if file_format is None:
+        file_format = "ndjson" if source.name.endswith((".ndjson", ".jsonl")) else "csv"
+    matches, results = import_results(source, file_format, batch_size)
+    print(f"Imported {matches} matches with {results} results")
+
+
+@click.command("recount")
+@with_appcontext
+def recount_command():
+    """
+    Rebuild the match counters of players, teams, games, maps and rulesets
+    """
+    recount_matches()
+    print("Match counters rebuilt")
+
+
 @click.command("adminkey")
 @with_appcontext
 def generate_admin_key():
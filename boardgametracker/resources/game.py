@@ -4,19 +4,26 @@ Functions for game class objects
 from sensorhub example
 https://github.com/enkwolf/pwp-course-sensorhub-api-example/blob/master/sensorhub/resources/sensor.py
 """
-import json
-
 from flask import Response, request, url_for
 from flask_restful import Resource
-from jsonschema import validate, ValidationError
+from jsonschema import ValidationError
 from sqlalchemy.exc import IntegrityError
 from werkzeug.exceptions import Conflict, BadRequest, UnsupportedMediaType
 
-from boardgametracker import cache
 from boardgametracker import db
 from boardgametracker.constants import *
 from boardgametracker.models import Game, Map, Ruleset
-from boardgametracker.utils import BGTBuilder,  require_admin
+from boardgametracker.utils import (
+    BGTBuilder,
+    require_admin,
+    cached_view,
+    conditional_view,
+    mason_response,
+    validate_json,
+    model_schema,
+    url_template,
+    forget_name
+)
 
 
 class GameCollection(Resource):
@@ -24,7 +31,7 @@ class GameCollection(Resource):
     Collection of games
     """
 
-    @cache.cached(timeout=5)
+    @cached_view("game")
     def get(self):
         """
         Get all games
@@ -56,14 +63,15 @@ class GameCollection(Resource):
         body.add_control_add_game()
         body["items"] = []
 
+        game_url = url_template("api.gameitem", "game")
         for game in Game.query.all():
             item = BGTBuilder(game.serialize(long=True))
             # create controls
-            item.add_control("self", url_for("api.gameitem", game=game))
+            item.add_control("self", game_url(game=game))
             item.add_control("profile", GAME_PROFILE)
             body["items"].append(item)
 
-        response = Response(json.dumps(body), 200, mimetype=MASON)
+        response = mason_response(body)
 
         return response
 
@@ -104,7 +112,7 @@ class GameCollection(Resource):
         if not request.mimetype == JSON:
             raise UnsupportedMediaType
         try:
-            validate(request.json, Game.get_schema())
+            validate_json(request.json, Game)
         except ValidationError as err:
             raise BadRequest(description=str(err))
         try:
@@ -129,6 +137,7 @@ class GameItem(Resource):
     One item of game
     """
 
+    @conditional_view("game", "map", "ruleset")
     def get(self, game):
         """
         Get information about a game
@@ -165,7 +174,7 @@ class GameItem(Resource):
         body.add_control("self", url_for("api.gameitem", game=game))
         body.add_control("profile", PLAYER_PROFILE)
         body.add_control("collection", url_for("api.gamecollection"))
-        body.add_control_put("edit", "Edit this game", url_for("api.gameitem", game=game), schema=Game.get_schema())
+        body.add_control_put("edit", "Edit this game", url_for("api.gameitem", game=game), schema=model_schema(Game))
         body.add_control_delete("Delete this game", url_for("api.gameitem", game=game))
 
         # add new map, ruleset
@@ -177,35 +186,37 @@ class GameItem(Resource):
         if game.map is not None:
             body["maps"] = []
             # for each "row" in this game's results:
+            map_url = url_template("api.mapitem", "game", "map_")
             for map_ in game.map:
                 item = BGTBuilder(map_.serialize(long=False))
-                item.add_control("self", url_for("api.mapitem", game=game, map_=map_))
+                href = map_url(game=game, map_=map_)
+                item.add_control("self", href)
                 item.add_control_put("edit",
                                      "Edit this map",
-                                     url_for("api.mapitem", game=game, map_=map_),
-                                     Map.get_schema()
+                                     href,
+                                     model_schema(Map)
                                      )
-                item.add_control_delete("Delete this map", url_for("api.mapitem", game=game, map_=map_))
+                item.add_control_delete("Delete this map", href)
                 body["maps"].append(item)
 
         # if ruleset(s) exists, add route to edit and delete it
         if game.ruleset is not None:
             body["rulesets"] = []
             # for each "row" in this game's results:
+            ruleset_url = url_template("api.rulesetitem", "game", "ruleset")
             for ruleset in game.ruleset:
                 item = BGTBuilder(ruleset.serialize(long=False))
-                item.add_control("self", url_for("api.rulesetitem", game=game, ruleset=ruleset))
+                href = ruleset_url(game=game, ruleset=ruleset)
+                item.add_control("self", href)
                 item.add_control_put("edit",
                                      "Edit this ruleset",
-                                     url_for("api.rulesetitem", game=game, ruleset=ruleset),
-                                     Ruleset.get_schema()
+                                     href,
+                                     model_schema(Ruleset)
                                      )
-                item.add_control_delete("Delete this ruleset",
-                                        url_for("api.rulesetitem", game=game, ruleset=ruleset)
-                                        )
+                item.add_control_delete("Delete this ruleset", href)
                 body["rulesets"].append(item)
 
-        response = Response(json.dumps(body), 200, mimetype=MASON)
+        response = mason_response(body)
 
         return response
 
@@ -250,9 +261,10 @@ class GameItem(Resource):
         if not request.mimetype == JSON:
             raise UnsupportedMediaType
         try:
-            validate(request.json, Game.get_schema())
+            validate_json(request.json, Game)
         except ValidationError as err:
             raise BadRequest(description=str(err))
+        forget_name(Game, game.name)
         game.name = request.json["name"]
 
         try:
@@ -289,6 +301,7 @@ class GameItem(Resource):
             - AdminKey: []
         """
 
+        forget_name(Game, game.name)
         db.session.delete(game)
         db.session.commit()
 
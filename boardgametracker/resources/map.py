@@ -4,19 +4,24 @@ Functions for map class objects
 from sensorhub example
 https://github.com/enkwolf/pwp-course-sensorhub-api-example/blob/master/sensorhub/resources/sensor.py
 """
-import json
-
 from flask import Response, request, abort, url_for
 from flask_restful import Resource
-from jsonschema import validate, ValidationError
+from jsonschema import ValidationError
 from sqlalchemy.exc import IntegrityError
 from werkzeug.exceptions import Conflict, BadRequest, UnsupportedMediaType
 
-from boardgametracker import cache
 from boardgametracker import db
-from boardgametracker.constants import JSON, MASON, MAP_PROFILE, LINK_RELATIONS_URL
+from boardgametracker.constants import JSON, MAP_PROFILE, LINK_RELATIONS_URL
 from boardgametracker.models import Map
-from boardgametracker.utils import BGTBuilder
+from boardgametracker.utils import (
+    BGTBuilder,
+    cached_view,
+    conditional_view,
+    mason_response,
+    validate_json,
+    model_schema,
+    url_template
+)
 
 
 class MapCollection(Resource):
@@ -24,7 +29,7 @@ class MapCollection(Resource):
     Collection of maps
     """
 
-    @cache.cached(timeout=5)
+    @cached_view("map", "game")
     def get(self, game):
         """
         Get all maps for the game given
@@ -54,16 +59,16 @@ class MapCollection(Resource):
         body.add_control_add_map(game)
         body["items"] = []
 
-        # for map_ in Map.query.filter_by(game_id=db_game.id):
-        for map_ in game.map:
+        map_url = url_template("api.mapitem", "game", "map_")
+        for map_ in Map.eager_query().filter_by(game_id=game.id).order_by(Map.id):
             # use serializer and BGTBuilder
             item = BGTBuilder(map_.serialize(long=True))
             # create controls for all items
-            item.add_control("self", url_for("api.mapitem", game=game, map_=map_))
+            item.add_control("self", map_url(game=game, map_=map_))
             item.add_control("profile", MAP_PROFILE)
             body["items"].append(item)
 
-        response = Response(json.dumps(body), 200, mimetype=MASON)
+        response = mason_response(body)
 
         return response
 
@@ -110,7 +115,7 @@ class MapCollection(Resource):
             abort(400)
 
         try:
-            validate(request.json, Map.get_schema())
+            validate_json(request.json, Map)
         except ValidationError as err:
             raise BadRequest(description=str(err))
         try:
@@ -135,6 +140,7 @@ class MapItem(Resource):
     One item of map
     """
 
+    @conditional_view("map", "game")
     def get(self, map_, game=None):
         """
         Get information about a map
@@ -166,10 +172,10 @@ class MapItem(Resource):
         body.add_control("profile", MAP_PROFILE)
         body.add_control("collection", url_for("api.mapcollection", game=game))
         body.add_control_put("edit", "Edit this map", url_for("api.mapitem", game=game, map_=map_), \
-                             schema=Map.get_schema())
+                             schema=model_schema(Map))
         body.add_control_delete("Delete this map", url_for("api.mapitem", game=game, map_=map_))
 
-        response = Response(json.dumps(body), 200, mimetype=MASON)
+        response = mason_response(body)
 
         return response
 
@@ -203,7 +209,7 @@ class MapItem(Resource):
         if not request.mimetype == JSON:
             raise UnsupportedMediaType
         try:
-            validate(request.json, Map.get_schema())
+            validate_json(request.json, Map)
         except ValidationError as err:
             raise BadRequest(description=str(err))
         try:
@@ -4,19 +4,46 @@ Functions for match class objects
 from sensorhub example
 https://github.com/enkwolf/pwp-course-sensorhub-api-example/blob/master/sensorhub/resources/sensor.py
 """
-import json
 from datetime import datetime
 
-from flask import Response, request, abort, url_for
+from flask import Response, request, abort, url_for, stream_with_context
 from flask_restful import Resource
-from jsonschema import validate, ValidationError
+from jsonschema import ValidationError
+from sqlalchemy import insert
 from sqlalchemy.exc import IntegrityError
 from werkzeug.exceptions import Conflict, BadRequest, UnsupportedMediaType
 
-from boardgametracker import db, cache
+from boardgametracker import db
 from boardgametracker.constants import *
-from boardgametracker.models import Match, PlayerResult, TeamResult, Game
-from boardgametracker.utils import BGTBuilder
+from boardgametracker.models import Match, PlayerResult, TeamResult, Game, MatchBatch, add_match_counts
+from boardgametracker.utils import (
+    BGTBuilder,
+    keyset_paginate,
+    cached_view,
+    stream_mason,
+    conditional_view,
+    mason_response,
+    validate_json,
+    model_schema,
+    url_template,
+    mark_tables_changed,
+    query_bool
+)
+
+
+# matches fetched at a time when streaming
+STREAM_BATCH = 500
+
+
+def _match_item(match, match_url):
+    """
+    One match of the collection with its controls
+    match_url is url_template("api.matchitem", "match")
+    """
+    item = BGTBuilder(match.serialize(long=True))
+    item.add_control("self", match_url(match=match))
+    item.add_control("profile", MATCH_PROFILE)
+    return item
 
 
 class MatchCollection(Resource):
@@ -24,10 +51,12 @@ class MatchCollection(Resource):
     Collection of matches
     """
 
-    @cache.cached(timeout=5)
+    @cached_view("match", "game", "map", "ruleset")
     def get(self):
         """
-        Get all matches
+        Get all matches, one page at a time
+        Pages are ordered by date and id, follow the next/prev controls
+        With ?stream=true all matches come in one streamed response
         From exercise 2,
         https://lovelace.oulu.fi/ohjelmoitava-web/ohjelmoitava-web/implementing-rest-apis-with-flask/
 
@@ -37,6 +66,10 @@ class MatchCollection(Resource):
         tags:
             - match
         description: Get all matches
+        parameters:
+            - $ref: '#/components/parameters/after_cursor'
+            - $ref: '#/components/parameters/before_cursor'
+            - $ref: '#/components/parameters/stream'
         responses:
             200:
                 description: List of matches
@@ -58,17 +91,26 @@ class MatchCollection(Resource):
         body.add_control_all_teams()
         body.add_control_all_games()
         body.add_control_add_match()
+        match_url = url_template("api.matchitem", "match")
+
+        if query_bool("stream"):
+            # whole table from a server side cursor, a batch at a time
+            matches = Match.stream_query().order_by(
+                Match.date, Match.id
+            ).yield_per(STREAM_BATCH)
+            items = (_match_item(match, match_url) for match in matches)
+            return Response(stream_with_context(stream_mason(body, items)), 200, mimetype=MASON)
+
         body["items"] = []
 
-        for match in Match.query.all():
+        matches, next_cursor, prev_cursor = keyset_paginate(Match.eager_query(), Match.date, Match.id)
+        body.add_control_pages("api.matchcollection", next_cursor, prev_cursor)
+
+        for match in matches:
             # use serializer and BGTBuilder
-            item = BGTBuilder(match.serialize(long=True))
-            # create controls for all items
-            item.add_control("self", url_for("api.matchitem", match=match))
-            item.add_control("profile", MATCH_PROFILE)
-            body["items"].append(item)
+            body["items"].append(_match_item(match, match_url))
 
-        response = Response(json.dumps(body), 200, mimetype=MASON)
+        response = mason_response(body)
 
         return response
 
@@ -118,7 +160,7 @@ class MatchCollection(Resource):
         if not request.mimetype == JSON:
             raise UnsupportedMediaType
         try:
-            validate(request.json, Match.get_schema())
+            validate_json(request.json, Match)
         except ValidationError as err:
             raise BadRequest(description=str(err))
 
@@ -147,11 +189,140 @@ class MatchCollection(Resource):
 
 
 
+class MatchBatchCollection(Resource):
+    """
+    Many matches with their results in one request
+    """
+
+    def post(self):
+        """
+        Add one or many matches with their player and team results
+        Everything is validated first and then added in one transaction,
+        with one INSERT statement per table
+
+        ---
+        tags:
+            - match
+        description: Add matches with their results in one request
+        requestBody:
+            description: One match or a list of matches, results inside their match
+            content:
+                application/json:
+                    schema:
+                        $ref: '#/components/schemas/MatchBatch'
+                    example:
+                        - date: '2022-12-25 00:00:00.000000'
+                          turns: 21
+                          game_id: 1
+                          ruleset_id: 1
+                          map_id: 2
+                          player_results:
+                            - points: 20
+                              player_id: 1
+                              team_id: 1
+                          team_results:
+                            - points: 20
+                              order: 1
+                              team_id: 1
+        responses:
+            201:
+                description: Matches added, items have the URI of each match
+                headers:
+                    Location:
+                        description: URI of the match if only one was sent
+                        schema:
+                            type: string
+            400:
+                description: Validation error
+            409:
+                description: Integrity error
+        """
+        if not request.mimetype == JSON:
+            raise UnsupportedMediaType
+        try:
+            validate_json(request.json, MatchBatch)
+        except ValidationError as err:
+            raise BadRequest(description=str(err))
+
+        batch = request.json if isinstance(request.json, list) else [request.json]
+        try:
+            match_rows = [
+                {
+                    "date": datetime.fromisoformat(item["date"]),
+                    "turns": item["turns"],
+                    "game_id": item.get("game_id"),
+                    "ruleset_id": item.get("ruleset_id"),
+                    "map_id": item.get("map_id"),
+                }
+                for item in batch
+            ]
+        except ValueError as err:
+            raise BadRequest(description=str(err))
+
+        try:
+            # rows with .id, enough for the MatchConverter of the self URLs
+            inserted = db.session.execute(
+                insert(Match).returning(Match.id, sort_by_parameter_order=True),
+                match_rows
+            ).all()
+            match_ids = [row.id for row in inserted]
+            player_rows = [
+                {
+                    "points": row["points"],
+                    "match_id": match_id,
+                    "player_id": row["player_id"],
+                    "team_id": row["team_id"],
+                }
+                for item, match_id in zip(batch, match_ids)
+                for row in item.get("player_results", [])
+            ]
+            team_rows = [
+                {
+                    "points": row["points"],
+                    "order": row["order"],
+                    "match_id": match_id,
+                    "team_id": row["team_id"],
+                }
+                for item, match_id in zip(batch, match_ids)
+                for row in item.get("team_results", [])
+            ]
+            if player_rows:
+                db.session.execute(insert(PlayerResult), player_rows)
+            if team_rows:
+                db.session.execute(insert(TeamResult), team_rows)
+
+            # bulk INSERTs skip the mapper events, count and invalidate here
+            add_match_counts(Match, match_rows)
+            add_match_counts(PlayerResult, player_rows)
+            add_match_counts(TeamResult, team_rows)
+            mark_tables_changed("match", "player_result", "team_result",
+                                "game", "map", "ruleset", "player", "team")
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            raise Conflict(description="A match or result refers to a missing row")
+
+        match_url = url_template("api.matchitem", "match")
+        body = BGTBuilder()
+        body["items"] = []
+        for row in inserted:
+            item = BGTBuilder()
+            item.add_control("self", match_url(match=row))
+            body["items"].append(item)
+
+        response = mason_response(body, 201)
+        if len(match_ids) == 1:
+            response.headers["Location"] = body["items"][0]["@controls"]["self"]["href"]
+        return response
+
+
 class MatchItem(Resource):
     """
     One item of match
     """
 
+    @conditional_view("match", "game", "map", "ruleset",
+                      "player_result", "team_result", "player", "team")
     def get(self, match):
         """
         Get information about a match
@@ -193,55 +364,62 @@ class MatchItem(Resource):
         body.add_control_put("edit",
                              "Edit this match",
                              url_for("api.matchitem", match=match),
-                             schema=Match.get_schema())
+                             schema=model_schema(Match))
         body.add_control_get_game(game=match.game)
         body.add_control_all_matches()
 
         # do controls for results
 
-        # if player_result exists, add route to edit player_result
-        if match.player_result is not None:
-            body["player_results"] = []
-            # for each "row" in this game's results:
-            for player_result in match.player_result:
-                item = BGTBuilder(player_result.serialize(long=False))
-                item.add_control("self", url_for("api.playerresultitem", player_result=player_result, match=match))
-                item.add_control_put("edit",
-                                     "Edit this row of playerresults",
-                                     url_for("api.playerresultitem", player_result=player_result, match=match),
-                                     PlayerResult.get_schema()
-                                     )
-                body["player_results"].append(item)
+        # rows of results with their players and teams, one query
+        body["player_results"] = []
+        player_results = PlayerResult.eager_query().filter_by(
+            match_id=match.id
+        ).order_by(PlayerResult.id)
+        player_result_url = url_template("api.playerresultitem", "player_result", "match")
+        for player_result in player_results:
+            item = BGTBuilder(player_result.serialize(long=False))
+            href = player_result_url(player_result=player_result, match=match)
+            item.add_control("self", href)
+            item.add_control_put("edit",
+                                 "Edit this row of playerresults",
+                                 href,
+                                 model_schema(PlayerResult)
+                                 )
+            body["player_results"].append(item)
 
         # always add "add" control for a row of results
         # this is not inside results, should it be?
         body.add_control_post("BGT:add-player-result",
                               "Add a row of playerresults",
                               url_for("api.playerresultcollection", match=match),
-                              PlayerResult.get_schema())
-
-        # # if result exists, add route to edit result
-        if match.team_result is not None:
-            body["team_results"] = []
-            for team_result in match.team_result:
-                item = BGTBuilder(team_result.serialize(long=False))
-                item.add_control("self", url_for("api.teamresultitem", team_result=team_result, match=match))
-                item.add_control_put("edit",
-                                     "Edit this row of teamresults",
-                                     url_for("api.teamresultitem", team_result=team_result, match=match),
-                                     TeamResult.get_schema()
-                                     )
-                body["team_results"].append(item)
+                              model_schema(PlayerResult))
+
+        # rows of team results with their teams, one query
+        body["team_results"] = []
+        team_results = TeamResult.eager_query().filter_by(
+            match_id=match.id
+        ).order_by(TeamResult.id)
+        team_result_url = url_template("api.teamresultitem", "team_result", "match")
+        for team_result in team_results:
+            item = BGTBuilder(team_result.serialize(long=False))
+            href = team_result_url(team_result=team_result, match=match)
+            item.add_control("self", href)
+            item.add_control_put("edit",
+                                 "Edit this row of teamresults",
+                                 href,
+                                 model_schema(TeamResult)
+                                 )
+            body["team_results"].append(item)
 
         # always add "add" control for a row of results
         # this is not inside results, should it be?
         body.add_control_post("BGT:add-team-result",
                               "Add a row of teamresults",
                               url_for("api.teamresultcollection", match=match),
-                              TeamResult.get_schema()
+                              model_schema(TeamResult)
                               )
 
-        response = Response(json.dumps(body), 200, mimetype=MASON)
+        response = mason_response(body)
         return response
 
     def put(self, match):
@@ -283,7 +461,7 @@ class MatchItem(Resource):
         if not request.mimetype == JSON:
             raise UnsupportedMediaType
         try:
-            validate(request.json, Match.get_schema())
+            validate_json(request.json, Match)
         except ValidationError as err:
             raise BadRequest(description=str(err))
 
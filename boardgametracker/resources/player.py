@@ -4,19 +4,29 @@ Functions for player class objects
 from sensorhub example
 https://github.com/enkwolf/pwp-course-sensorhub-api-example/blob/master/sensorhub/resources/sensor.py
 """
-import json
-
 from flask import Response, request, url_for
 from flask_restful import Resource
-from jsonschema import validate, ValidationError
+from jsonschema import ValidationError
+from sqlalchemy import select
 from sqlalchemy.exc import IntegrityError
 from werkzeug.exceptions import Conflict, BadRequest, UnsupportedMediaType
 
-from boardgametracker import cache
 from boardgametracker import db
 from boardgametracker.constants import *
-from boardgametracker.models import Player, Match
-from boardgametracker.utils import BGTBuilder, require_admin, require_this_user
+from boardgametracker.models import Player, Match, PlayerResult
+from boardgametracker.utils import (
+    BGTBuilder,
+    require_admin,
+    require_this_user,
+    keyset_paginate,
+    cached_view,
+    conditional_view,
+    mason_response,
+    validate_json,
+    model_schema,
+    url_template,
+    forget_name
+)
 
 
 class PlayerCollection(Resource):
@@ -24,7 +34,7 @@ class PlayerCollection(Resource):
     Collection of players
     """
 
-    @cache.cached(timeout=5)
+    @cached_view("player")
     def get(self):
         """
         Get all players
@@ -54,14 +64,15 @@ class PlayerCollection(Resource):
         body.add_control_add_player()
         body["items"] = []
 
+        player_url = url_template("api.playeritem", "player")
         for player in Player.query.all():
             item = BGTBuilder(player.serialize(long=True))
             # create controls
-            item.add_control("self", url_for("api.playeritem", player=player))
+            item.add_control("self", player_url(player=player))
             item.add_control("profile", PLAYER_PROFILE)
             body["items"].append(item)
 
-        response = Response(json.dumps(body), 200, mimetype=MASON)
+        response = mason_response(body)
 
         return response
 
@@ -99,7 +110,7 @@ class PlayerCollection(Resource):
         if not request.mimetype == JSON:
             raise UnsupportedMediaType
         try:
-            validate(request.json, Player.get_schema())
+            validate_json(request.json, Player)
         except ValidationError as err:
             raise BadRequest(description=str(err))
         try:
@@ -124,6 +135,7 @@ class PlayerItem(Resource):
     One item of player
     """
 
+    @conditional_view("player", "player_result", "match", "game", "map", "ruleset")
     def get(self, player):
         """
         Get information about a player
@@ -136,6 +148,8 @@ class PlayerItem(Resource):
         description: Get one player
         parameters:
             - $ref: '#/components/parameters/player_name'
+            - $ref: '#/components/parameters/after_cursor'
+            - $ref: '#/components/parameters/before_cursor'
         responses:
             200:
                 description: Player's information
@@ -152,21 +166,28 @@ class PlayerItem(Resource):
         body.add_control("profile", PLAYER_PROFILE)
         body.add_control("collection", url_for("api.playercollection"))
         body.add_control_put("edit", "Edit this player", \
-                             url_for("api.playeritem", player=player), schema=Player.get_schema())
+                             url_for("api.playeritem", player=player), schema=model_schema(Player))
         body.add_control_delete("Delete this player", url_for("api.playeritem", player=player))
 
-        # link to the matches the player has played:
-        if player.player_result is not None:
-            body["matches"] = []
-            for row in player.player_result:
-                match = Match.query.filter_by(id=row.match_id).first()
-
-                item = BGTBuilder(match.serialize(long=True))
-                item.add_control("self", url_for("api.matchitem", match=match))
-                item.add_control("profile", MATCH_PROFILE)
-                body["matches"].append(item)
+        # link to the matches the player has played, one page at a time
+        # matches come in one query with their game, map and ruleset
+        matches, next_cursor, prev_cursor = keyset_paginate(
+            Match.eager_query().filter(Match.id.in_(
+                select(PlayerResult.match_id).where(PlayerResult.player_id == player.id)
+            )),
+            Match.date,
+            Match.id
+        )
+        body.add_control_pages("api.playeritem", next_cursor, prev_cursor, player=player)
+        body["matches"] = []
+        match_url = url_template("api.matchitem", "match")
+        for match in matches:
+            item = BGTBuilder(match.serialize(long=True))
+            item.add_control("self", match_url(match=match))
+            item.add_control("profile", MATCH_PROFILE)
+            body["matches"].append(item)
 
-        response = Response(json.dumps(body), 200, mimetype=MASON)
+        response = mason_response(body)
 
         return response
 
@@ -203,10 +224,11 @@ class PlayerItem(Resource):
         if not request.mimetype == JSON:
             raise UnsupportedMediaType
         try:
-            validate(request.json, Player.get_schema())
+            validate_json(request.json, Player)
         except ValidationError as err:
             raise BadRequest(description=str(err))
 
+        forget_name(Player, player.name)
         player.name = request.json["name"]
         try:
             db.session.commit()
@@ -236,6 +258,7 @@ class PlayerItem(Resource):
                 description: Player deleted, nothing to return
 
         """
+        forget_name(Player, player.name)
         db.session.delete(player)
         db.session.commit()
 
@@ -4,17 +4,22 @@ Functions for player_result class objects
 from sensorhub example
 https://github.com/enkwolf/pwp-course-sensorhub-api-example/blob/master/sensorhub/resources/sensor.py
 """
-import json
-
 from flask import Response, request, abort, url_for
 from flask_restful import Resource
-from jsonschema import validate, ValidationError
+from jsonschema import ValidationError
 from werkzeug.exceptions import BadRequest, UnsupportedMediaType
 
-from boardgametracker import cache, db
+from boardgametracker import db
 from boardgametracker.constants import *
 from boardgametracker.models import PlayerResult
-from boardgametracker.utils import BGTBuilder
+from boardgametracker.utils import (
+    BGTBuilder,
+    cached_view,
+    mason_response,
+    validate_json,
+    model_schema,
+    url_template
+)
 
 
 class PlayerResultCollection(Resource):
@@ -22,7 +27,7 @@ class PlayerResultCollection(Resource):
     Collection of player_results
     """
 
-    @cache.cached(timeout=5)
+    @cached_view("player_result", "player", "team")
     def get(self, match):
         """
         Get all results for a match
@@ -58,13 +63,17 @@ class PlayerResultCollection(Resource):
 
         # get results for match
 
-        for result in match.player_result:
+        results = PlayerResult.eager_query().filter_by(
+            match_id=match.id
+        ).order_by(PlayerResult.id)
+        player_result_url = url_template("api.playerresultitem", "match", "player_result")
+        for result in results:
             item = BGTBuilder(result.serialize(long=True))
-            item.add_control("self", url_for("api.playerresultitem", match=match, player_result=result))
+            item.add_control("self", player_result_url(match=match, player_result=result))
             item.add_control("profile", PLAYER_RESULT_PROFILE)
             body["items"].append(item)
 
-        response = Response(json.dumps(body), 200, mimetype=MASON)
+        response = mason_response(body)
 
         return response
 
@@ -110,7 +119,7 @@ class PlayerResultCollection(Resource):
             abort(400)
 
         try:
-            validate(request.json, PlayerResult.get_schema())
+            validate_json(request.json, PlayerResult)
         except ValidationError as err:
             raise BadRequest(description=str(err))
         try:
@@ -138,7 +147,7 @@ class PlayerResultItem(Resource):
     item of player_result
     """
 
-    @cache.cached(timeout=5)
+    @cached_view("player_result", "player", "team")
     def get(self, player_result, match):
         """
         Get one row of results
@@ -174,7 +183,7 @@ class PlayerResultItem(Resource):
                              url_for("api.playerresultitem",
                                      match=match,
                                      player_result=player_result),
-                             schema=PlayerResult.get_schema()
+                             schema=model_schema(PlayerResult)
                              )
         body.add_control_delete("Delete this row",
                                 url_for("api.playerresultitem",
@@ -182,7 +191,7 @@ class PlayerResultItem(Resource):
                                         player_result=player_result
                                         )
                                 )
-        response = Response(json.dumps(body), 200, mimetype=MASON)
+        response = mason_response(body)
 
         return response
 
@@ -219,7 +228,7 @@ class PlayerResultItem(Resource):
         if not request.mimetype == JSON:
             raise UnsupportedMediaType
         try:
-            validate(request.json, PlayerResult.get_schema())
+            validate_json(request.json, PlayerResult)
         except ValidationError as err:
             raise BadRequest(description=str(err))
 
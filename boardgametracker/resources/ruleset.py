@@ -4,19 +4,24 @@ Functions for ruleset class objects
 from sensorhub example
 https://github.com/enkwolf/pwp-course-sensorhub-api-example/blob/master/sensorhub/resources/sensor.py
 """
-import json
-
 from flask import Response, request, abort, url_for
 from flask_restful import Resource
-from jsonschema import validate, ValidationError
+from jsonschema import ValidationError
 from sqlalchemy.exc import IntegrityError
 from werkzeug.exceptions import Conflict, BadRequest, UnsupportedMediaType
 
-from boardgametracker import cache
 from boardgametracker import db
-from boardgametracker.constants import JSON, MASON, RULESET_PROFILE, LINK_RELATIONS_URL
+from boardgametracker.constants import JSON, RULESET_PROFILE, LINK_RELATIONS_URL
 from boardgametracker.models import Ruleset
-from boardgametracker.utils import BGTBuilder
+from boardgametracker.utils import (
+    BGTBuilder,
+    cached_view,
+    conditional_view,
+    mason_response,
+    validate_json,
+    model_schema,
+    url_template
+)
 
 
 class RulesetCollection(Resource):
@@ -24,7 +29,7 @@ class RulesetCollection(Resource):
     Collection of rulesets
     """
 
-    @cache.cached(timeout=5)
+    @cached_view("ruleset", "game")
     def get(self, game):
         """
         Get all rulesets
@@ -57,15 +62,16 @@ class RulesetCollection(Resource):
         body["items"] = []
 
         # append objects to list
-        for ruleset in game.ruleset:
+        ruleset_url = url_template("api.rulesetitem", "game", "ruleset")
+        for ruleset in Ruleset.eager_query().filter_by(game_id=game.id).order_by(Ruleset.id):
             # use serializer and BGTBuilder
             item = BGTBuilder(ruleset.serialize(long=True))
             # create controls for all items
-            item.add_control("self", url_for("api.rulesetitem", game=game, ruleset=ruleset))
+            item.add_control("self", ruleset_url(game=game, ruleset=ruleset))
             item.add_control("profile", RULESET_PROFILE)
             body["items"].append(item)
 
-        response = Response(json.dumps(body), 200, mimetype=MASON)
+        response = mason_response(body)
 
         return response
 
@@ -114,7 +120,7 @@ class RulesetCollection(Resource):
             game_id = game.serialize(long=True)["id"]
 
         try:
-            validate(request.json, Ruleset.get_schema())
+            validate_json(request.json, Ruleset)
         except ValidationError as err:
             raise BadRequest(description=str(err))
 
@@ -142,6 +148,7 @@ class RulesetItem(Resource):
     One item of ruleset
     """
 
+    @conditional_view("ruleset", "game")
     def get(self, ruleset, game=None):
         """
         Get information about a ruleset
@@ -174,11 +181,11 @@ class RulesetItem(Resource):
         body.add_control("collection", url_for("api.rulesetcollection", game=game))
         body.add_control_put("edit", "Edit this ruleset", url_for("api.rulesetitem", \
                                                                   game=game, ruleset=ruleset),
-                             schema=Ruleset.get_schema())
+                             schema=model_schema(Ruleset))
         body.add_control_delete("Delete this ruleset", \
                                 url_for("api.rulesetitem", game=game, ruleset=ruleset))
 
-        response = Response(json.dumps(body), 200, mimetype=MASON)
+        response = mason_response(body)
 
         return response
 
@@ -210,7 +217,7 @@ class RulesetItem(Resource):
         if not request.mimetype == JSON:
             raise UnsupportedMediaType
         try:
-            validate(request.json, Ruleset.get_schema())
+            validate_json(request.json, Ruleset)
         except ValidationError as err:
             raise BadRequest(description=str(err))
 
@@ -4,19 +4,27 @@ Functions for team class objects
 from sensorhub example
 https://github.com/enkwolf/pwp-course-sensorhub-api-example/blob/master/sensorhub/resources/sensor.py
 """
-import json
-
 from flask import Response, request, url_for
 from flask_restful import Resource
-from jsonschema import validate, ValidationError
+from jsonschema import ValidationError
+from sqlalchemy import select
 from sqlalchemy.exc import IntegrityError
 from werkzeug.exceptions import Conflict, BadRequest, UnsupportedMediaType
 
-from boardgametracker import cache
 from boardgametracker import db
 from boardgametracker.constants import *
-from boardgametracker.models import Team, Match
-from boardgametracker.utils import BGTBuilder
+from boardgametracker.models import Team, Match, TeamResult
+from boardgametracker.utils import (
+    BGTBuilder,
+    keyset_paginate,
+    cached_view,
+    conditional_view,
+    mason_response,
+    validate_json,
+    model_schema,
+    url_template,
+    forget_name
+)
 
 
 class TeamCollection(Resource):
@@ -24,7 +32,7 @@ class TeamCollection(Resource):
     Collection of teams
     """
 
-    @cache.cached(timeout=5)
+    @cached_view("team")
     def get(self):
         """
         Get all teams
@@ -52,14 +60,15 @@ class TeamCollection(Resource):
         body.add_control_add_team()
         body["items"] = []
 
+        team_url = url_template("api.teamitem", "team")
         for team in Team.query.all():
             item = BGTBuilder(team.serialize(long=True))
             # create controls
-            item.add_control("self", url_for("api.teamitem", team=team))
+            item.add_control("self", team_url(team=team))
             item.add_control("profile", TEAM_PROFILE)
             body["items"].append(item)
 
-        response = Response(json.dumps(body), 200, mimetype=MASON)
+        response = mason_response(body)
 
         return response
 
@@ -96,7 +105,7 @@ class TeamCollection(Resource):
         if not request.mimetype == JSON:
             raise UnsupportedMediaType
         try:
-            validate(request.json, Team.get_schema())
+            validate_json(request.json, Team)
         except ValidationError as err:
             raise BadRequest(description=str(err))
         try:
@@ -122,6 +131,7 @@ class TeamItem(Resource):
     One item of team
     """
 
+    @conditional_view("team", "team_result", "match", "game", "map", "ruleset")
     def get(self, team):
         """
         Get information about a team
@@ -134,6 +144,8 @@ class TeamItem(Resource):
         description: Get one team
         parameters:
             - $ref: '#/components/parameters/team_name'
+            - $ref: '#/components/parameters/after_cursor'
+            - $ref: '#/components/parameters/before_cursor'
         responses:
             200:
                 description: Team's information
@@ -152,21 +164,28 @@ class TeamItem(Resource):
         body.add_control("collection", url_for("api.teamcollection"))
         body.add_control_put("edit",
                              "Edit this team",
-                             url_for("api.teamitem", team=team), schema=Team.get_schema())
+                             url_for("api.teamitem", team=team), schema=model_schema(Team))
         body.add_control_delete("Delete this team", url_for("api.teamitem", team=team))
 
-        # link to the matches the team has played:
-        if team.team_result is not None:
-            body["matches"] = []
-            for row in team.team_result:
-                match = Match.query.filter_by(id=row.match_id).first()
-
-                item = BGTBuilder(match.serialize(long=True))
-                item.add_control("self", url_for("api.matchitem", match=match))
-                item.add_control("profile", MATCH_PROFILE)
-                body["matches"].append(item)
+        # link to the matches the team has played, one page at a time
+        # matches come in one query with their game, map and ruleset
+        matches, next_cursor, prev_cursor = keyset_paginate(
+            Match.eager_query().filter(Match.id.in_(
+                select(TeamResult.match_id).where(TeamResult.team_id == team.id)
+            )),
+            Match.date,
+            Match.id
+        )
+        body.add_control_pages("api.teamitem", next_cursor, prev_cursor, team=team)
+        body["matches"] = []
+        match_url = url_template("api.matchitem", "match")
+        for match in matches:
+            item = BGTBuilder(match.serialize(long=True))
+            item.add_control("self", match_url(match=match))
+            item.add_control("profile", MATCH_PROFILE)
+            body["matches"].append(item)
 
-        response = Response(json.dumps(body), 200, mimetype=MASON)
+        response = mason_response(body)
 
         return response
 
@@ -199,10 +218,11 @@ class TeamItem(Resource):
         if not request.mimetype == JSON:
             raise UnsupportedMediaType
         try:
-            validate(request.json, Team.get_schema())
+            validate_json(request.json, Team)
         except ValidationError as err:
             raise BadRequest(description=str(err))
 
+        forget_name(Team, team.name)
         team.name = request.json["name"]
         try:
             db.session.commit()
@@ -231,6 +251,7 @@ class TeamItem(Resource):
             204:
                 description: Team deleted, nothing to return
         """
+        forget_name(Team, team.name)
         db.session.delete(team)
         db.session.commit()
 
@@ -4,17 +4,22 @@ Functions for team_result class objects
 from sensorhub example
 https://github.com/enkwolf/pwp-course-sensorhub-api-example/blob/master/sensorhub/resources/sensor.py
 """
-import json
-
 from flask import Response, request, abort, url_for
 from flask_restful import Resource
-from jsonschema import validate, ValidationError
+from jsonschema import ValidationError
 from werkzeug.exceptions import BadRequest, UnsupportedMediaType
 
-from boardgametracker import cache, db
+from boardgametracker import db
 from boardgametracker.constants import *
 from boardgametracker.models import TeamResult
-from boardgametracker.utils import BGTBuilder
+from boardgametracker.utils import (
+    BGTBuilder,
+    cached_view,
+    mason_response,
+    validate_json,
+    model_schema,
+    url_template
+)
 
 
 class TeamResultCollection(Resource):
@@ -22,7 +27,7 @@ class TeamResultCollection(Resource):
     Collection of team_results
     """
 
-    @cache.cached(timeout=5)
+    @cached_view("team_result", "team")
     def get(self, match):
         """
         Get all team_results for a match
@@ -58,13 +63,17 @@ class TeamResultCollection(Resource):
 
         # get results for match
 
-        for result in match.team_result:
+        results = TeamResult.eager_query().filter_by(
+            match_id=match.id
+        ).order_by(TeamResult.id)
+        team_result_url = url_template("api.teamresultitem", "match", "team_result")
+        for result in results:
             item = BGTBuilder(result.serialize(long=True))
-            item.add_control("self", url_for("api.teamresultitem", match=match, team_result=result))
+            item.add_control("self", team_result_url(match=match, team_result=result))
             item.add_control("profile", TEAM_RESULT_PROFILE)
             body["items"].append(item)
 
-        response = Response(json.dumps(body), 200, mimetype=MASON)
+        response = mason_response(body)
 
         return response
 
@@ -109,7 +118,7 @@ class TeamResultCollection(Resource):
             abort(400)
 
         try:
-            validate(request.json, TeamResult.get_schema())
+            validate_json(request.json, TeamResult)
         except ValidationError as err:
             raise BadRequest(description=str(err))
         try:
@@ -137,7 +146,7 @@ class TeamResultItem(Resource):
     item of team_result
     """
 
-    @cache.cached(timeout=5)
+    @cached_view("team_result", "team")
     def get(self, team_result, match):
         """
         Get one row of results
@@ -173,7 +182,7 @@ class TeamResultItem(Resource):
                              url_for("api.teamresultitem",
                                      match=match,
                                      team_result=team_result),
-                             schema=TeamResult.get_schema()
+                             schema=model_schema(TeamResult)
                              )
         body.add_control_delete("Delete this row",
                                 url_for("api.teamresultitem",
@@ -181,7 +190,7 @@ class TeamResultItem(Resource):
                                         team_result=team_result
                                         )
                                 )
-        response = Response(json.dumps(body), 200, mimetype=MASON)
+        response = mason_response(body)
 
         return response
 
@@ -218,7 +227,7 @@ class TeamResultItem(Resource):
         if not request.mimetype == JSON:
             raise UnsupportedMediaType
         try:
-            validate(request.json, TeamResult.get_schema())
+            validate_json(request.json, TeamResult)
         except ValidationError as err:
             raise BadRequest(description=str(err))
 
@@ -4,15 +4,38 @@ Converters for URL calls
 from example
 https://github.com/enkwolf/pwp-course-sensorhub-api-example/blob/master/sensorhub/utils.py"""
 
+import base64
+import hashlib
+import json
+import re
 import secrets
-
-from flask import url_for, request
-from werkzeug.exceptions import NotFound, Forbidden
+import time
+from datetime import datetime
+from itertools import chain, count
+
+from flask import Response, current_app, g, has_app_context, url_for, request
+from jsonschema.exceptions import best_match
+from jsonschema.validators import validator_for
+from sqlalchemy import and_, event, or_
+from werkzeug.exceptions import NotFound, Forbidden, BadRequest
 from werkzeug.routing import BaseConverter
 
-from functools import wraps
+from functools import partial, wraps
+
+# optional faster JSON encoders, stdlib json is used if neither is installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import ujson
+except ImportError:
+    ujson = None
 
+from boardgametracker import db, cache
+from boardgametracker.constants import MASON
 from boardgametracker.models import (
+    MATCH_COUNTERS,
     Player,
     Team,
     Game,
@@ -21,6 +44,7 @@ from boardgametracker.models import (
     Match,
     PlayerResult,
     TeamResult,
+    MatchBatch,
     ApiKey
 )
 
@@ -183,15 +207,49 @@ class BGTBuilder(MasonBuilder):
     https://lovelace.oulu.fi/ohjelmoitava-web/ohjelmoitava-web/exercise-3-api-documentation-and-hypermedia/
     """
 
+    def add_namespace(self, ns, uri):
+        """
+        Same as MasonBuilder.add_namespace, the namespace is built only once
+        """
+        if "@namespaces" not in self:
+            self["@namespaces"] = {}
+
+        self["@namespaces"][ns] = shared_fragment(
+            ("namespace", ns, uri),
+            lambda: {"name": uri}
+        )
+
+    def add_shared_control(self, ctrl_name, build):
+        """
+        Add a control that is the same in every response
+        build(builder) adds the control to an empty builder, it is called
+        once per script root and the result is reused, see shared_fragment
+        """
+        def build_control():
+            builder = BGTBuilder()
+            build(builder)
+            return builder["@controls"][ctrl_name]
+
+        if "@controls" not in self:
+            self["@controls"] = {}
+
+        self["@controls"][ctrl_name] = shared_fragment(
+            ("control", request.script_root, ctrl_name),
+            build_control
+        )
+
     def add_control_all_matches(self):
         """
         Match collection
         leads to GET /api/matches/
         """
-        self.add_control_get(
-            ctrl_name="BGT:all-matches",
-            href=url_for("api.matchcollection"),
-            title="All matches"
+        self.add_shared_control(
+            "BGT:all-matches",
+            lambda builder: builder.add_control_get(
+                ctrl_name="BGT:all-matches",
+                href=url_for("api.matchcollection"),
+                title="All matches"
+            )
         )
 
     def add_control_add_match(self):
@@ -199,11 +257,14 @@ class BGTBuilder(MasonBuilder):
         Add a new match
         leads to Post /api/matches/
         """
-        self.add_control_post(
-            ctrl_name="BGT:add-match",
-            href=url_for("api.matchcollection"),
-            schema=Match.get_schema(),
-            title="Add match"
+        self.add_shared_control(
+            "BGT:add-match",
+            lambda builder: builder.add_control_post(
+                ctrl_name="BGT:add-match",
+                href=url_for("api.matchcollection"),
+                schema=Match.get_schema(),
+                title="Add match"
+            )
         )
 
     def add_control_all_players(self):
@@ -211,10 +272,13 @@ class BGTBuilder(MasonBuilder):
         Get all game's players
         leads to GET /api/players/
         """
-        self.add_control_get(
-            ctrl_name="BGT:all-players",
-            href=url_for("api.playercollection"),
-            title="All players"
+        self.add_shared_control(
+            "BGT:all-players",
+            lambda builder: builder.add_control_get(
+                ctrl_name="BGT:all-players",
+                href=url_for("api.playercollection"),
+                title="All players"
+            )
         )
 
     def add_control_add_player(self):
@@ -222,11 +286,14 @@ class BGTBuilder(MasonBuilder):
         Add a new player
         leads to Post /api/players/
         """
-        self.add_control_post(
-            ctrl_name="BGT:add-player",
-            href=url_for("api.playercollection"),
-            schema=Player.get_schema(),
-            title="Add player"
+        self.add_shared_control(
+            "BGT:add-player",
+            lambda builder: builder.add_control_post(
+                ctrl_name="BGT:add-player",
+                href=url_for("api.playercollection"),
+                schema=Player.get_schema(),
+                title="Add player"
+            )
         )
 
     def add_control_all_teams(self):
@@ -234,10 +301,13 @@ class BGTBuilder(MasonBuilder):
         Get all teams
         leads to GET /api/teams/
         """
-        self.add_control_get(
-            ctrl_name="BGT:all-teams",
-            href=url_for("api.teamcollection"),
-            title="All teams"
+        self.add_shared_control(
+            "BGT:all-teams",
+            lambda builder: builder.add_control_get(
+                ctrl_name="BGT:all-teams",
+                href=url_for("api.teamcollection"),
+                title="All teams"
+            )
         )
 
     def add_control_add_team(self):
@@ -245,11 +315,14 @@ class BGTBuilder(MasonBuilder):
         Add a new team
         leads to POST /api/teams/
         """
-        self.add_control_post(
-            ctrl_name="BGT:add-team",
-            href=url_for("api.teamcollection"),
-            schema=Team.get_schema(),
-            title="Add team"
+        self.add_shared_control(
+            "BGT:add-team",
+            lambda builder: builder.add_control_post(
+                ctrl_name="BGT:add-team",
+                href=url_for("api.teamcollection"),
+                schema=Team.get_schema(),
+                title="Add team"
+            )
         )
 
     def add_control_all_games(self):
@@ -257,10 +330,13 @@ class BGTBuilder(MasonBuilder):
         Get all games
         leads to GET /api/games/
         """
-        self.add_control_get(
-            ctrl_name="BGT:all-games",
-            href=url_for("api.gamecollection"),
-            title="All games"
+        self.add_shared_control(
+            "BGT:all-games",
+            lambda builder: builder.add_control_get(
+                ctrl_name="BGT:all-games",
+                href=url_for("api.gamecollection"),
+                title="All games"
+            )
         )
 
     def add_control_add_game(self):
@@ -268,11 +344,14 @@ class BGTBuilder(MasonBuilder):
         Add a new game
         leads to Post /api/games/
         """
-        self.add_control_post(
-            ctrl_name="BGT:add-game",
-            href=url_for("api.gamecollection"),
-            schema=Game.get_schema(),
-            title="Add game"
+        self.add_shared_control(
+            "BGT:add-game",
+            lambda builder: builder.add_control_post(
+                ctrl_name="BGT:add-game",
+                href=url_for("api.gamecollection"),
+                schema=Game.get_schema(),
+                title="Add game"
+            )
         )
 
     def add_control_all_maps(self, game):
@@ -294,7 +373,7 @@ class BGTBuilder(MasonBuilder):
         self.add_control_post(
             ctrl_name="BGT:add-map",
             href=url_for("api.mapcollection", game=game),
-            schema=Map.get_schema(),
+            schema=model_schema(Map),
             title="Add map"
         )
 
@@ -317,7 +396,7 @@ class BGTBuilder(MasonBuilder):
         self.add_control_post(
             ctrl_name="BGT:add-ruleset",
             href=url_for("api.rulesetcollection", game=game),
-            schema=Ruleset.get_schema(),
+            schema=model_schema(Ruleset),
             title="Add ruleset"
         )
 
@@ -366,6 +445,505 @@ class BGTBuilder(MasonBuilder):
             title="Go to team"
         )
 
+    def add_control_next(self, href):
+        """
+        Next page of a paginated list
+        """
+        self.add_control_get(
+            ctrl_name="next",
+            href=href,
+            title="Next page"
+        )
+
+    def add_control_prev(self, href):
+        """
+        Previous page of a paginated list
+        """
+        self.add_control_get(
+            ctrl_name="prev",
+            href=href,
+            title="Previous page"
+        )
+
+    def add_control_pages(self, endpoint, next_cursor, prev_cursor, **values):
+        """
+        Add next and prev controls for the cursors given by keyset_paginate
+        Controls are left out if there is no page to that direction
+        """
+        if next_cursor is not None:
+            self.add_control_next(url_for(endpoint, after=next_cursor, **values))
+        if prev_cursor is not None:
+            self.add_control_prev(url_for(endpoint, before=prev_cursor, **values))
+
+
+# JSON that is the same in every response, see shared_fragment
+SHARED_FRAGMENTS = {}
+# pre-encoded bytes of the shared pieces by their quoted placeholder
+FRAGMENT_BYTES = {}
+# random for every process, so no data in a response can look like a placeholder
+_FRAGMENT_PREFIX = f"bgt-fragment-{secrets.token_hex(8)}-"
+_FRAGMENT_RE = re.compile(b'"' + re.escape(_FRAGMENT_PREFIX.encode()) + rb'\d+"')
+_FRAGMENT_IDS = count()
+
+
+class _Fragment(str):
+    """
+    Placeholder of a shared piece in a body, every encoder writes it as
+    a string and encode_json puts the pre-encoded piece in its place
+    """
+    __slots__ = ()
+
+
+def shared_fragment(key, build):
+    """
+    Build a piece of a response body once and reuse it
+
+    The piece is encoded once and a placeholder is given for the body,
+    encode_json splices the bytes into every response as is. Works the
+    same with orjson, ujson and stdlib json.
+    """
+    try:
+        return SHARED_FRAGMENTS[key]
+    except KeyError:
+        pass
+    # pieces can have pieces of their own, like schemas in controls
+    data = _splice_fragments(_dumps(build()))
+    placeholder = _Fragment(f"{_FRAGMENT_PREFIX}{next(_FRAGMENT_IDS)}")
+    FRAGMENT_BYTES[b'"' + placeholder.encode() + b'"'] = data
+    SHARED_FRAGMENTS[key] = placeholder
+    return placeholder
+
+
+def _splice_fragments(data):
+    """
+    Put the pre-encoded shared pieces in place of their placeholders
+    """
+    if _FRAGMENT_PREFIX.encode() not in data:
+        return data
+    return _FRAGMENT_RE.sub(lambda match: FRAGMENT_BYTES[match.group()], data)
+
+
+def model_schema(model):
+    """
+    JSON schema of a model for the schema of POST and PUT controls
+    """
+    return shared_fragment(("schema", model), model.get_schema)
+
+
+class _UrlField:
+    """
+    Stand-in for a model when url_for builds a URL template
+    Every attribute a converter reads (id or name) becomes a placeholder
+    """
+
+    def __init__(self, argument):
+        self.argument = argument
+
+    def __getattr__(self, attr):
+        return f"\x00{self.argument}.{attr}\x00"
+
+
+# prebuilt routes, (SCRIPT_NAME, endpoint, *arguments) -> render function
+URL_TEMPLATES = {}
+
+
+def _build_url_template(endpoint, arguments):
+    """
+    Build a route once with url_for and make a function that fills in
+    the ids and names with string joining, url_for is used if the route
+    takes something else than models
+    """
+    rules = list(current_app.url_map.iter_rules(endpoint))
+    if len(rules) != 1 or rules[0].arguments != set(arguments):
+        return partial(url_for, endpoint)
+
+    built = url_for(endpoint, **{argument: _UrlField(argument) for argument in arguments})
+    pieces = built.split("\x00")
+    prefix = pieces[0]
+    rest = [(tuple(field.split(".")), part) for field, part in zip(pieces[1::2], pieces[2::2])]
+
+    def render(**values):
+        url = prefix
+        for (argument, attr), part in rest:
+            url += str(getattr(values[argument], attr)) + part
+        return url
+
+    return render
+
+
+def url_template(endpoint, *arguments):
+    """
+    Function that gives the same as url_for(endpoint, **values) when called
+    with the models named in arguments, for example
+    url_template("api.matchitem", "match")(match=match) == "/api/match/1/"
+    Get it once before a loop over items, it is built only once per route
+    """
+    # script_root is worked out again on every access, SCRIPT_NAME is cheap
+    key = (request.environ.get("SCRIPT_NAME", ""), endpoint, *arguments)
+    try:
+        return URL_TEMPLATES[key]
+    except KeyError:
+        template = URL_TEMPLATES[key] = _build_url_template(endpoint, arguments)
+        return template
+
+
+def _dumps(obj):
+    """
+    Encode to UTF-8 JSON bytes with the fastest encoder installed
+    orjson, then ujson, then stdlib json
+    """
+    if orjson is not None:
+        return orjson.dumps(obj)
+    if ujson is not None:
+        return ujson.dumps(obj, ensure_ascii=False).encode()
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def encode_json(obj):
+    """
+    Encode to UTF-8 JSON bytes, see _dumps and shared_fragment
+    With INSTRUMENTATION the time is added to the serialization time
+    of the request
+    """
+    timings = g.get("timings") if has_app_context() else None
+    if timings is None:
+        return _splice_fragments(_dumps(obj))
+    start = time.perf_counter()
+    data = _splice_fragments(_dumps(obj))
+    timings["serialize"] += time.perf_counter() - start
+    return data
+
+
+def mason_response(body, status=200):
+    """
+    Response with a Mason body, all views should give their bodies through this
+    """
+    return Response(encode_json(body), status, mimetype=MASON)
+
+
+# one compiled validator per model, see compile_validators
+SCHEMA_VALIDATORS = {}
+
+
+def compile_validators():
+    """
+    Check the schema of every model and build its validator once
+    Called from create_app
+    """
+    for model in (Player, Team, Game, Map, Ruleset, Match, PlayerResult, TeamResult, MatchBatch):
+        schema = model.get_schema()
+        validator_class = validator_for(schema)
+        validator_class.check_schema(schema)
+        SCHEMA_VALIDATORS[model] = validator_class(schema)
+
+
+def validate_json(instance, model):
+    """
+    Same as jsonschema.validate(instance, model.get_schema()) but the
+    validator is reused, the schema is not built and checked every time
+    Raises ValidationError
+    """
+    if model not in SCHEMA_VALIDATORS:
+        compile_validators()
+    error = best_match(SCHEMA_VALIDATORS[model].iter_errors(instance))
+    if error is not None:
+        raise error
+
+
+def stream_mason(body, items, key="items", chunk_size=100):
+    """
+    Encode a Mason body piece by piece for a streamed Response
+
+    body is encoded first, then the list under key is filled from the
+    items iterable. Only chunk_size items are held in memory at a time.
+    Use with flask.stream_with_context.
+    """
+    head = encode_json(body)
+    yield head[:-1] + (b"," if body else b"") + encode_json(key) + b":["
+    chunk = []
+    separator = b""
+    for item in items:
+        chunk.append(separator + encode_json(item))
+        separator = b","
+        if len(chunk) >= chunk_size:
+            yield b"".join(chunk)
+            chunk = []
+    chunk.append(b"]}")
+    yield b"".join(chunk)
+
+
+def encode_cursor(date, id_):
+    """
+    Make an opaque page cursor from the sort keys of a row
+    """
+    raw = f"{date.isoformat()}|{id_}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Read the sort keys back from a page cursor
+    Gives BadRequest if the cursor is broken
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode()).decode()
+        date, id_ = raw.split("|")
+        return datetime.fromisoformat(date), int(id_)
+    except ValueError:
+        raise BadRequest(description="Invalid page cursor")
+
+
+def query_bool(name):
+    """
+    Boolean from the query string, false if missing
+    true/1 and a bare ?name are true, false/0 false, others give BadRequest
+    """
+    value = request.args.get(name)
+    if value is None:
+        return False
+    value = value.lower()
+    if value in ("", "1", "true"):
+        return True
+    if value in ("0", "false"):
+        return False
+    raise BadRequest(description=f"{name} must be true or false")
+
+
+def keyset_paginate(query, date_column, id_column):
+    """
+    Keyset (cursor) pagination ordered by (date, id)
+
+    Reads "after" or "before" cursor from the query string and
+    returns (rows, next_cursor, prev_cursor). Cursors are None
+    if there is no page to that direction.
+    Every page costs the same, no OFFSET is used.
+    """
+    page_size = current_app.config["PAGE_SIZE"]
+    after = request.args.get("after")
+    before = request.args.get("before")
+
+    if before is not None:
+        date, id_ = decode_cursor(before)
+        # walk backwards and turn the page around
+        rows = query.filter(or_(
+            date_column < date,
+            and_(date_column == date, id_column < id_)
+        )).order_by(
+            date_column.desc(), id_column.desc()
+        ).limit(page_size + 1).all()
+        has_prev = len(rows) > page_size
+        rows = rows[:page_size][::-1]
+        has_next = True
+    else:
+        if after is not None:
+            date, id_ = decode_cursor(after)
+            query = query.filter(or_(
+                date_column > date,
+                and_(date_column == date, id_column > id_)
+            ))
+        rows = query.order_by(
+            date_column.asc(), id_column.asc()
+        ).limit(page_size + 1).all()
+        has_next = len(rows) > page_size
+        rows = rows[:page_size]
+        has_prev = after is not None
+
+    next_cursor = None
+    prev_cursor = None
+    if rows and has_next:
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, date_column.key), getattr(last, id_column.key))
+    if rows and has_prev:
+        first = rows[0]
+        prev_cursor = encode_cursor(getattr(first, date_column.key), getattr(first, id_column.key))
+
+    return rows, next_cursor, prev_cursor
+
+
+# timeout of the table versions, much longer than any view lives. Caches
+# that are full drop the entries that expire first, a timeout of 0 would
+# make the versions go first and orphan every cached view
+VERSION_TIMEOUT = 365 * 24 * 60 * 60
+
+
+def table_versions(tables):
+    """
+    Current versions of the tables from the cache
+    A missing version gets a new random value, so an evicted or expired
+    version can never bring back old cache entries
+    """
+    known = g.setdefault("table_versions", {})
+    missing = [table for table in tables if table not in known]
+    if missing:
+        keys = [f"version/{table}" for table in missing]
+        for table, key, version in zip(missing, keys, cache.get_many(*keys)):
+            if version is None:
+                version = secrets.token_hex(8)
+                cache.set(key, version, timeout=VERSION_TIMEOUT)
+            known[table] = version
+    return [known[table] for table in tables]
+
+
+def bump_table_versions(tables):
+    """
+    Give the tables new versions, cache entries made from the
+    old data are not used anymore
+    """
+    known = g.get("table_versions", {})
+    for table in tables:
+        known.pop(table, None)
+        cache.set(f"version/{table}", secrets.token_hex(8), timeout=VERSION_TIMEOUT)
+
+
+def view_etag(tables):
+    """
+    Strong ETag of a GET view, from the path, the query string and
+    the versions of the tables the view reads
+    """
+    versions = table_versions(tables)
+    raw = f"{request.full_path}|{'.'.join(versions)}"
+    return hashlib.sha256(raw.encode()).hexdigest()[:32]
+
+
+def conditional_view(*tables):
+    """
+    ETag and If-None-Match for GET views that read the given tables
+    Gives 304 without running the view if the client has the current version
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            etag = view_etag(tables)
+            if request.if_none_match.contains(etag):
+                response = Response(status=304)
+            else:
+                response = func(*args, **kwargs)
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            # always ask again, the answer is cheap when nothing changed
+            response.cache_control.no_cache = True
+            return response
+        return wrapper
+    return decorator
+
+
+def cached_view(*tables):
+    """
+    conditional_view and cache.cached for GET views that read the given tables
+
+    The key has the path, the query string and the versions of the tables.
+    Committing changes to any of the tables bumps its version, so stale
+    entries are never served and the timeout can be long.
+    """
+    def make_key():
+        versions = table_versions(tables)
+        return f"view/{request.full_path}/{'.'.join(versions)}"
+
+    def decorator(func):
+        # streamed responses are produced on the fly, they cannot be cached
+        cached = cache.cached(
+            key_prefix=make_key,
+            response_filter=lambda response: not response.is_streamed
+        )
+        return conditional_view(*tables)(cached(func))
+    return decorator
+
+
+@event.listens_for(db.session, "after_flush")
+def _collect_changed_tables(session, flush_context):
+    """
+    Remember which tables this transaction has changed
+    Counters of MATCH_COUNTERS change with their child tables
+    """
+    changed = session.info.setdefault("changed_tables", set())
+    for obj in chain(session.new, session.dirty, session.deleted):
+        changed.add(obj.__table__.name)
+        for child, column, model in MATCH_COUNTERS:
+            if isinstance(obj, child):
+                changed.add(model.__tablename__)
+
+
+def mark_tables_changed(*tables):
+    """
+    Tell the cache about writes the ORM does not see, like bulk INSERTs
+    and UPDATEs, their versions are bumped on commit
+    """
+    db.session.info.setdefault("changed_tables", set()).update(tables)
+
+
+@event.listens_for(db.session, "after_commit")
+def _invalidate_changed_tables(session):
+    """
+    Changes are visible now, drop cached views that used the old data
+    """
+    changed = session.info.pop("changed_tables", None)
+    if changed:
+        bump_table_versions(sorted(changed))
+
+
+@event.listens_for(db.session, "after_rollback")
+def _forget_changed_tables(session):
+    """
+    Nothing was changed after all
+    """
+    session.info.pop("changed_tables", None)
+
+
+def get_for_url(model, column, value):
+    """
+    Row of model where column is value, for the URL converters
+    Rows are kept in g, so one request fetches each row only once. Models
+    with an eager_query come with their parents in the same query.
+    Raises NotFound if there is no such row
+    """
+    converted = g.setdefault("converted", {})
+    key = (model, column, value)
+    if key not in converted:
+        query = model.eager_query() if hasattr(model, "eager_query") else model.query
+        converted[key] = query.filter_by(**{column: value}).first()
+    db_row = converted[key]
+    if db_row is None:
+        raise NotFound
+    return db_row
+
+
+# name -> primary key of players, teams and games for the whole process
+NAME_IDS = {}
+
+
+def get_by_name(model, name):
+    """
+    Row of model by its unique name, for the URL converters
+
+    The primary key of a name is remembered, later requests use
+    Session.get with it. The name is checked after get, so an entry gone
+    stale in another worker falls back to the query by name.
+    Handlers that rename or delete call forget_name.
+    Raises NotFound
+    """
+    key = (model, name)
+    id_ = NAME_IDS.get(key)
+    if id_ is not None:
+        db_row = db.session.get(model, id_)
+        if db_row is not None and db_row.name == name:
+            return db_row
+    try:
+        db_row = get_for_url(model, "name", name)
+    except NotFound:
+        NAME_IDS.pop(key, None)
+        raise
+    NAME_IDS[key] = db_row.id
+    return db_row
+
+
+def forget_name(model, name):
+    """
+    Drop a name from NAME_IDS, call before renaming or deleting the row
+    """
+    NAME_IDS.pop((model, name), None)
+
+
 class PlayerConverter(BaseConverter):
     """
     Converter for player URL
@@ -375,10 +953,7 @@ class PlayerConverter(BaseConverter):
         """
         URL to python
         """
-        db_player = Player.query.filter_by(name=value).first()
-        if db_player is None:
-            raise NotFound
-        return db_player
+        return get_by_name(Player, value)
 
     def to_url(self, value):
         """
@@ -396,10 +971,7 @@ class MatchConverter(BaseConverter):
         """
         URL to python
         """
-        db_match = Match.query.filter_by(id=value).first()
-        if db_match is None:
-            raise NotFound
-        return db_match
+        return get_for_url(Match, "id", value)
 
     def to_url(self, value):
         """
@@ -417,10 +989,7 @@ class GameConverter(BaseConverter):
         """
         URL to python
         """
-        db_game = Game.query.filter_by(name=value).first()
-        if db_game is None:
-            raise NotFound
-        return db_game
+        return get_by_name(Game, value)
 
     def to_url(self, value):
         """
@@ -438,10 +1007,7 @@ class TeamConverter(BaseConverter):
         """
         URL to python
         """
-        db_team = Team.query.filter_by(name=value).first()
-        if db_team is None:
-            raise NotFound
-        return db_team
+        return get_by_name(Team, value)
 
     def to_url(self, value):
         """
@@ -459,10 +1025,7 @@ class RulesetConverter(BaseConverter):
         """
         URL to python
         """
-        db_ruleset = Ruleset.query.filter_by(id=value).first()
-        if db_ruleset is None:
-            raise NotFound
-        return db_ruleset
+        return get_for_url(Ruleset, "id", value)
 
     def to_url(self, value):
         """
@@ -480,10 +1043,7 @@ class MapConverter(BaseConverter):
         """
         URL to python
         """
-        db_map = Map.query.filter_by(id=value).first()
-        if db_map is None:
-            raise NotFound
-        return db_map
+        return get_for_url(Map, "id", value)
 
     def to_url(self, value):
         """
@@ -501,10 +1061,7 @@ class PlayerResultConverter(BaseConverter):
         """
         URL to python
         """
-        db_player_result = PlayerResult.query.filter_by(id=value).first()
-        if db_player_result is None:
-            raise NotFound
-        return db_player_result
+        return get_for_url(PlayerResult, "id", value)
 
     def to_url(self, value):
         """
@@ -522,10 +1079,7 @@ class TeamResultConverter(BaseConverter):
         """
         URL to python
         """
-        db_team_result = TeamResult.query.filter_by(id=value).first()
-        if db_team_result is None:
-            raise NotFound
-        return db_team_result
+        return get_for_url(TeamResult, "id", value)
 
     def to_url(self, value):
         """
@@ -534,6 +1088,43 @@ class TeamResultConverter(BaseConverter):
         return str(value.id)
 
 
+# hash -> (admin, player_id) of every ApiKey, see api_key_index
+API_KEYS = {"version": None, "loaded": 0.0, "keys": {}}
+
+
+def api_key_index():
+    """
+    All API keys by their hash, read from the database again when the
+    api_key table has a new version. The adminkey and userkey commands
+    commit like any other write, so their keys are seen by the next request.
+    Keys changed outside the ORM session (raw SQL, other tools) do not bump
+    the version, the index is also read again after API_KEY_RELOAD seconds
+    so that a revoked key does not stay valid until a restart.
+    """
+    version, = table_versions(["api_key"])
+    now = time.monotonic()
+    expired = now - API_KEYS["loaded"] >= current_app.config["API_KEY_RELOAD"]
+    if API_KEYS["version"] != version or expired:
+        rows = db.session.execute(db.select(ApiKey.key, ApiKey.admin, ApiKey.player_id))
+        API_KEYS["keys"] = {key: (admin, player_id) for key, admin, player_id in rows}
+        API_KEYS["version"] = version
+        API_KEYS["loaded"] = now
+    return API_KEYS["keys"]
+
+
+def request_api_key():
+    """
+    (admin, player_id) of the key in the BGT-Api-Key header
+    None if there is no header or the key is unknown
+    The index is looked up by the SHA-256 hash of the key, the time of
+    the lookup can only tell about the hash, not about the key
+    """
+    key = request.headers.get("BGT-Api-Key")
+    if key is None:
+        return None
+    return api_key_index().get(ApiKey.key_hash(key.strip()))
+
+
 def require_admin(func):
     """
     Decorator for admin requirement
@@ -544,13 +1135,9 @@ def require_admin(func):
     """
     @wraps(func)
     def wrapper(*args, **kwargs):
-        try:
-            key_hash = ApiKey.key_hash(request.headers.get("BGT-Api-Key").strip())
-            db_key = ApiKey.query.filter_by(admin=True).first()
-            if secrets.compare_digest(key_hash, db_key.key):
-                return func(*args, **kwargs)
-            raise Forbidden
-        except: AttributeError
+        api_key = request_api_key()
+        if api_key is not None and api_key[0]:
+            return func(*args, **kwargs)
         raise Forbidden
     return wrapper
 
@@ -569,20 +1156,11 @@ def require_this_user(func):
     # needs self, otherwise doesn't understand player
     # return also self and player in func
     def wrapper(self, player, *args, **kwargs):
-        try:
-            admin_hash = ApiKey.key_hash(request.headers.get("BGT-Api-Key").strip())
-            # check if admin
-            db_key = ApiKey.query.filter_by(admin=True).first()
-            if secrets.compare_digest(key_hash, db_key.key):
-                return func(self, player, *args, **kwargs)
-            # check if this user
-            db_key = ApiKey.query.filter_by(player_id=player.id).first()
-            if db_key is not None and (
-                    secrets.compare_digest(key_hash, db_key.key)
-                ):
+        api_key = request_api_key()
+        if api_key is not None:
+            admin, player_id = api_key
+            if admin or player_id == player.id:
                 return func(self, player, *args, **kwargs)
-            raise Forbidden
-        except: AttributeError
         raise Forbidden
     return wrapper
 
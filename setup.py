@@ -17,11 +17,16 @@ setup(
         "flask-restful",
         "flask-sqlalchemy",
         "jsonschema",
-        "SQLAlchemy",
+        # RETURNING with sort_by_parameter_order of the match batch endpoint
+        "SQLAlchemy>=2.0.10",
         "pylint",
         "pytest",
         "pytest-cov",
         "flasgger"
-    ]
+    ],
+    extras_require={
+        # faster JSON encoding of responses
+        "fast": ["orjson"]
+    }
 
 )
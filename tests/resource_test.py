@@ -11,15 +11,24 @@ import tempfile
 from datetime import datetime
 import json
 from werkzeug.datastructures import Headers
+from flask import url_for
 from flask.testing import FlaskClient
 from sqlalchemy import event
-from sqlalchemy.engine import Engine
 import pytest
 
 
-from boardgametracker import create_app, db
+from cachelib import SimpleCache
+from jsonschema import validate, ValidationError
+
+from boardgametracker import create_app, db, cache
+from boardgametracker.caching import TwoTierCache
+from boardgametracker.instrumentation import LATENCY_BUCKETS_MS, reset_stats
+from boardgametracker import utils
+from boardgametracker.utils import (
+    validate_json, model_schema, url_template, table_versions, BGTBuilder, NAME_IDS
+)
 from boardgametracker.models import Player, Match, Game \
-, Map, Ruleset, Team, PlayerResult, TeamResult
+, Map, Ruleset, Team, PlayerResult, TeamResult, ApiKey
 
 # from
 #https://github.com/enkwolf/pwp-course-sensorhub-api-example/blob/master/tests/resource_test.py
@@ -45,28 +54,23 @@ class AuthHeaderClient(FlaskClient):
         kwargs['headers'] = headers
         return super().open(*args, **kwargs)
 
-@event.listens_for(Engine, "connect")
-def set_sqlite_pragma(dbapi_connection, connection_record):
-    """
-    Listener
-    """
-    cursor = dbapi_connection.cursor()
-    cursor.execute("PRAGMA foreign_keys=ON")
-    cursor.close()
+# foreign keys are turned on by SQLITE_PRAGMAS of the app, not here
 
 
 
-@pytest.fixture
-def client():
+def _make_client(**extra_config):
     """
-    from
-    https://github.com/enkwolf/pwp-course-sensorhub-api-example/blob/master/tests/resource_test.py
+    Test app with a populated database and its AuthHeaderClient
+    Returns the file descriptor of the database too
     """
     db_fd, db_fname = tempfile.mkstemp()
     config = {
         "SQLALCHEMY_DATABASE_URI": "sqlite:///" + db_fname,
-        "TESTING": True
+        "TESTING": True,
+        # own cache for every test app, not shared files
+        "CACHE_TYPE": "SimpleCache"
     }
+    config.update(extra_config)
 
     app = create_app(config)
 
@@ -75,16 +79,40 @@ def client():
         _populate_db()
 
     app.test_client_class = AuthHeaderClient
-    yield app.test_client()
+    return db_fd, app.test_client()
+
+@pytest.fixture
+def client():
+    """
+    from
+    https://github.com/enkwolf/pwp-course-sensorhub-api-example/blob/master/tests/resource_test.py
+    """
+    db_fd, test_client = _make_client()
+    yield test_client
 
     os.close(db_fd)
     #os.unlink(db_fname)
     # ^this gives error about permissions in win32
 
+@pytest.fixture
+def instrumented_client():
+    """
+    Client of an app with INSTRUMENTATION on and empty stats,
+    every query is a slow query
+    """
+    reset_stats()
+    db_fd, test_client = _make_client(INSTRUMENTATION=True, SLOW_QUERY_MS=0)
+    yield test_client
+
+    os.close(db_fd)
+
 def _populate_db():
     """
     Populate database with dummy data
     """
+    # AuthHeaderClient sends TEST_KEY
+    db.session.add(ApiKey(name="admin", key=ApiKey.key_hash(TEST_KEY), admin=True))
+
     game = Game(name="CS:GO")
     db.session.add(game)
     game = Game(name="Battlefield")
@@ -132,6 +160,60 @@ def _populate_db():
 
     db.session.commit()
 
+def _count_queries(client, url):
+    """
+    GET the url with an empty cache and count the SQL statements it runs
+    """
+    statements = []
+
+    def _count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with client.application.app_context():
+        cache.clear()
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", _count)
+    try:
+        resp = client.get(url)
+    finally:
+        event.remove(engine, "before_cursor_execute", _count)
+    assert resp.status_code == 200
+    return len(statements)
+
+def _match_counts(client):
+    """
+    Read the match counters of players, teams and games straight from the database
+    """
+    with client.application.app_context():
+        return (
+            {p.name: p.match_count for p in Player.query.all()},
+            {t.name: t.match_count for t in Team.query.all()},
+            {g.name: g.match_count for g in Game.query.all()},
+        )
+
+def _add_more_rows(client):
+    """
+    Add more matches and results that use different games, maps and players
+    """
+    with client.application.app_context():
+        db.session.add(Player(name="John-4"))
+        db.session.add(Team(name="delta"))
+        db.session.add(Game(name="Chess"))
+        db.session.add(Map(name="inferno", game_id=1))
+        db.session.add(Ruleset(name="casual", game_id=1))
+        for i in range(4):
+            match = Match(date=datetime.now(), turns=i, game_id=1 + i % 2,
+                          ruleset_id=1 + i % 2, map_id=1 + i)
+            db.session.add(match)
+        db.session.flush()
+        for player_id in range(1, 4):
+            for match_id in range(1, 7):
+                db.session.add(PlayerResult(points=player_id, match_id=match_id,
+                                            player_id=player_id, team_id=1 + player_id % 3))
+        for match_id in range(1, 7):
+            db.session.add(TeamResult(points=10, order=1, match_id=match_id, team_id=1 + match_id % 3))
+        db.session.commit()
+
 def _get_player_json():
     """
     Creates a valid player JSON object to be used for PUT and POST tests.
@@ -197,6 +279,8 @@ class TestPlayerCollection():
         assert len(body) == 3
         for item in body["items"]:
             assert "name" in item
+        counts = {item["name"]: item["matches"] for item in body["items"]}
+        assert counts == {"John-1": 1, "John-2": 0, "John-3": 0}
 
     def test_post_valid_request(self, client):
         """
@@ -236,6 +320,24 @@ class TestPlayerItem():
         resp = client.get(self.RESOURCE_URL)
         body = json.loads(resp.data)
         assert len(body) > 0
+        assert len(body["matches"]) == 1
+        assert body["matches"][0]["game_name"] == "CS:GO"
+
+    def test_get_match_pages(self, client):
+        """
+        Test that the player's matches are paginated
+        """
+        _add_more_rows(client)
+        client.application.config["PAGE_SIZE"] = 4
+        resp = client.get(self.RESOURCE_URL)
+        body = json.loads(resp.data)
+        assert len(body["matches"]) == 4
+        resp = client.get(body["@controls"]["next"]["href"])
+        body = json.loads(resp.data)
+        # six matches, one of them has two rows for this player
+        assert len(body["matches"]) == 2
+        assert "next" not in body["@controls"]
+        assert "prev" in body["@controls"]
 
     def test_delete_valid(self, client):
         """
@@ -283,6 +385,38 @@ class TestPlayerItem():
         resp = client.put(self.RESOURCE_URL, json=key_err)
         assert resp.status_code == 400
 
+    def test_api_keys(self, client):
+        """
+        Player keys can edit only their own player, unknown keys nothing
+        New keys work right after they are committed
+        """
+        # without the admin key of AuthHeaderClient
+        plain = FlaskClient(client.application, client.application.response_class)
+        user_key = {"BGT-api-key": "thisisauserkey"}
+        resp = plain.put(self.RESOURCE_URL, json={"name": "John-1"})
+        assert resp.status_code == 403
+        resp = plain.put(self.RESOURCE_URL, json={"name": "John-1"}, headers=user_key)
+        assert resp.status_code == 403
+
+        with client.application.app_context():
+            db.session.add(ApiKey(name="john", key=ApiKey.key_hash("thisisauserkey"), player_id=1))
+            db.session.commit()
+
+        resp = plain.put(self.RESOURCE_URL, json={"name": "John-1"}, headers=user_key)
+        assert resp.status_code == 204
+        resp = plain.put("/api/player/John-2/", json={"name": "John-2"}, headers=user_key)
+        assert resp.status_code == 403
+
+        # revoked outside the app, seen after API_KEY_RELOAD seconds
+        with client.application.app_context():
+            with db.engine.begin() as connection:
+                connection.exec_driver_sql("DELETE FROM api_key WHERE player_id = 1")
+        resp = plain.put(self.RESOURCE_URL, json={"name": "John-1"}, headers=user_key)
+        assert resp.status_code == 204
+        client.application.config["API_KEY_RELOAD"] = 0
+        resp = plain.put(self.RESOURCE_URL, json={"name": "John-1"}, headers=user_key)
+        assert resp.status_code == 403
+
 class TestMatchCollection():
     """
     Test for MatchCollection
@@ -305,6 +439,63 @@ class TestMatchCollection():
             assert "map_name" in item
             assert "ruleset_name" in item
 
+    def test_get_pages(self, client):
+        """
+        Test keyset pagination with next and prev controls
+        """
+        client.application.config["PAGE_SIZE"] = 1
+        resp = client.get(self.RESOURCE_URL)
+        assert resp.status_code == 200
+        body = json.loads(resp.data)
+        assert len(body["items"]) == 1
+        first_id = body["items"][0]["id"]
+        assert "prev" not in body["@controls"]
+
+        # follow next
+        resp = client.get(body["@controls"]["next"]["href"])
+        assert resp.status_code == 200
+        body = json.loads(resp.data)
+        assert len(body["items"]) == 1
+        assert body["items"][0]["id"] != first_id
+        assert "next" not in body["@controls"]
+
+        # and back
+        resp = client.get(body["@controls"]["prev"]["href"])
+        body = json.loads(resp.data)
+        assert body["items"][0]["id"] == first_id
+        assert "prev" not in body["@controls"]
+
+        # broken cursor
+        resp = client.get(self.RESOURCE_URL + "?after=notacursor")
+        assert resp.status_code == 400
+
+    def test_get_stream(self, client):
+        """
+        Test streamed list, all matches in one response
+        """
+        _add_more_rows(client)
+        client.application.config["PAGE_SIZE"] = 1
+        resp = client.get(self.RESOURCE_URL + "?stream=1")
+        assert resp.status_code == 200
+        assert resp.is_streamed
+        body = json.loads(resp.data)
+        assert len(body["items"]) == 6
+        assert "BGT" in body["@namespaces"]
+        assert "next" not in body["@controls"]
+        dates = [(item["date"], item["id"]) for item in body["items"]]
+        assert dates == sorted(dates)
+
+        # not cached, new matches show up
+        client.post(self.RESOURCE_URL, json=_get_match_json())
+        resp = client.get(self.RESOURCE_URL + "?stream=1")
+        assert len(json.loads(resp.data)["items"]) == 7
+
+        # stream=false is the paged list
+        body = json.loads(client.get(self.RESOURCE_URL + "?stream=false").data)
+        assert len(body["items"]) == 1
+        assert "next" in body["@controls"]
+        assert client.get(self.RESOURCE_URL + "?stream=maybe").status_code == 400
+
     def test_post_valid_request(self, client):
         """
         Test post function
@@ -336,6 +527,86 @@ class TestMatchCollection():
         resp = client.post(self.RESOURCE_URL, json=key_err)
         assert resp.status_code == 400
 
+class TestMatchBatch():
+    """
+    Test for MatchBatchCollection
+    """
+
+    RESOURCE_URL = "/api/matches/batch/"
+
+    @staticmethod
+    def _batch():
+        """
+        Two matches with results
+        """
+        return [
+            {"date": "2023-01-01T10:00:00", "turns": 10, "game_id": 1, "map_id": 1, "ruleset_id": 1,
+             "player_results": [{"points": 5, "player_id": 1, "team_id": 1},
+                                {"points": 6, "player_id": 2, "team_id": 1}],
+             "team_results": [{"points": 11, "order": 1, "team_id": 1}]},
+            {"date": "2023-01-02T10:00:00", "turns": 12, "game_id": 2,
+             "player_results": [{"points": 7, "player_id": 2, "team_id": 2}]},
+        ]
+
+    def test_post_valid_request(self, client):
+        """
+        Matches, results and counters are added in one request
+        """
+        # the list is cached before the batch
+        matches = json.loads(client.get("/api/matches/").data)["items"]
+        resp = client.post(self.RESOURCE_URL, json=self._batch())
+        assert resp.status_code == 201
+        assert "Location" not in resp.headers
+        hrefs = [item["@controls"]["self"]["href"] for item in json.loads(resp.data)["items"]]
+        assert len(hrefs) == 2
+
+        body = json.loads(client.get(hrefs[0]).data)
+        assert body["item"]["turns"] == 10
+        assert len(body["player_results"]) == 2
+        assert len(body["team_results"]) == 1
+        assert len(json.loads(client.get("/api/matches/").data)["items"]) == len(matches) + 2
+
+        players, teams, games = _match_counts(client)
+        assert players == {"John-1": 2, "John-2": 2, "John-3": 0}
+        assert games["CS:GO"] == 2
+
+        # one match without a list has a Location
+        resp = client.post(self.RESOURCE_URL, json=self._batch()[1])
+        assert resp.status_code == 201
+        assert client.get(resp.headers["Location"]).status_code == 200
+
+    def test_post_invalid(self, client):
+        """
+        Nothing is added if any match or result is wrong
+        """
+        before = json.loads(client.get("/api/matches/").data)["items"]
+        batch = self._batch()
+        del batch[1]["player_results"][0]["points"]
+        resp = client.post(self.RESOURCE_URL, json=batch)
+        assert resp.status_code == 400
+
+        batch = self._batch()
+        batch[1]["date"] = "yesterday"
+        resp = client.post(self.RESOURCE_URL, json=batch)
+        assert resp.status_code == 400
+
+        # foreign keys are checked with the SQLITE_PRAGMAS of the app
+        batch = self._batch()
+        batch[1]["player_results"][0]["player_id"] = 100
+        resp = client.post(self.RESOURCE_URL, json=batch)
+        assert resp.status_code == 409
+        batch = self._batch()
+        batch[1]["game_id"] = 99
+        resp = client.post(self.RESOURCE_URL, json=batch)
+        assert resp.status_code == 409
+        with client.application.app_context():
+            assert Match.query.count() == 2
+            assert PlayerResult.query.filter(PlayerResult.player_id == 100).count() == 0
+
+        resp = client.post(self.RESOURCE_URL, data="notjson")
+        assert resp.status_code == 415
+        assert json.loads(client.get("/api/matches/").data)["items"] == before
+
 class TestMatchItem():
     """
     Test for MatchItem
@@ -409,6 +680,8 @@ class TestGameCollection():
         assert len(body["items"]) == 2
         for item in body["items"]:
             assert "name" in item
+        counts = {item["name"]: item["matches"] for item in body["items"]}
+        assert counts == {"CS:GO": 1, "Battlefield": 1}
 
     def test_post_valid_request(self, client):
         """
@@ -780,6 +1053,24 @@ class TestTeamItem():
         resp = client.delete(self.INVALID_URL)
         assert resp.status_code == 404
 
+    def test_name_cache(self, client):
+        """
+        Names are found by primary key after the first lookup and
+        renames and stale entries do not lead to the wrong team
+        """
+        assert client.get(self.RESOURCE_URL).status_code == 200
+        assert (Team, "gamma") in NAME_IDS
+
+        resp = client.put(self.RESOURCE_URL, json={"name": "delta"})
+        assert resp.status_code == 204
+        assert client.get(self.RESOURCE_URL).status_code == 404
+        assert client.get("/api/team/delta/").status_code == 200
+
+        # entry left behind by another worker
+        NAME_IDS[(Team, "alpha")] = NAME_IDS[(Team, "delta")]
+        body = json.loads(client.get("/api/team/alpha/").data)
+        assert body["item"]["name"] == "alpha"
+
     def test_put(self, client):
         """
         Test put function
@@ -854,6 +1145,725 @@ class TestTeamResultCollection():
             assert "order" in item
             assert "team_id" in item
 
+class TestQueryCount():
+    """
+    Test that lists do not run queries per item
+    """
+
+    URLS = [
+        "/api/matches/",
+        "/api/players/",
+        "/api/teams/",
+        "/api/games/",
+        "/api/game/CS:GO/maps/",
+        "/api/game/CS:GO/rulesets/",
+        "/api/match/1/",
+        "/api/match/1/playerresults/",
+        "/api/match/1/teamresults/",
+        "/api/player/John-1/",
+        "/api/team/alpha/",
+    ]
+
+    @pytest.mark.parametrize("url", URLS)
+    def test_fixed_query_count(self, client, url):
+        """
+        Same number of queries with more rows in the database
+        """
+        before = _count_queries(client, url)
+        _add_more_rows(client)
+        after = _count_queries(client, url)
+        assert before == after
+
+    @pytest.mark.parametrize("url, queries", [
+        ("/api/game/CS:GO/map/1/", 2),
+        ("/api/match/1/", 3),
+        ("/api/match/1/playerresult/1/", 2),
+        ("/api/match/1/teamresult/1/", 2),
+    ])
+    def test_converters_fetch_once(self, client, url, queries):
+        """
+        Every row in the URL is fetched once, with its parents
+        """
+        assert _count_queries(client, url) == queries
+
+class TestMatchCounters():
+    """
+    Test the match_count columns kept on write
+    """
+
+    def test_counters_follow_writes(self, client):
+        """
+        POST, PUT and DELETE of results and matches move the counters
+        """
+        players, teams, games = _match_counts(client)
+        assert players == {"John-1": 1, "John-2": 0, "John-3": 0}
+        assert teams == {"alpha": 1, "beta": 0, "gamma": 0}
+        assert games == {"CS:GO": 1, "Battlefield": 1}
+
+        resp = client.post("/api/match/1/playerresults/",
+                           json={"points": 5, "player_id": 2, "team_id": 2})
+        assert resp.status_code == 201
+        location = resp.headers["Location"]
+        players, _, _ = _match_counts(client)
+        assert players["John-2"] == 1
+
+        # move the row to another player
+        resp = client.put(location, json={"points": 5, "player_id": 3, "team_id": 2})
+        assert resp.status_code == 204
+        players, _, _ = _match_counts(client)
+        assert players["John-2"] == 0
+        assert players["John-3"] == 1
+
+        resp = client.delete(location)
+        assert resp.status_code == 204
+        players, _, _ = _match_counts(client)
+        assert players["John-3"] == 0
+
+        resp = client.post("/api/match/2/teamresults/",
+                           json={"points": 5, "order": 1, "team_id": 3})
+        assert resp.status_code == 201
+        _, teams, _ = _match_counts(client)
+        assert teams["gamma"] == 1
+
+        resp = client.post("/api/matches/", json=_get_match_json())
+        assert resp.status_code == 201
+        _, _, games = _match_counts(client)
+        assert games["CS:GO"] == 2
+
+        resp = client.delete("/api/match/2/")
+        assert resp.status_code == 204
+        _, _, games = _match_counts(client)
+        assert games["Battlefield"] == 0
+
+    def test_recount(self, client):
+        """
+        Test that flask recount rebuilds broken counters
+        """
+        app = client.application
+        with app.app_context():
+            db.session.execute(db.update(Player).values(match_count=99))
+            db.session.commit()
+        result = app.test_cli_runner().invoke(args=["recount"])
+        assert result.exit_code == 0
+        players, _, _ = _match_counts(client)
+        assert players == {"John-1": 1, "John-2": 0, "John-3": 0}
+
+class TestIndexes():
+    """
+    Test that hot queries use indexes instead of table scans
+    """
+
+    QUERIES = [
+        ("SELECT * FROM player_result WHERE match_id = 1", "ix_player_result_match_id"),
+        ("SELECT * FROM player_result WHERE player_id = 1", "ix_player_result_player_id"),
+        ("SELECT * FROM player_result WHERE team_id = 1", "ix_player_result_team_id"),
+        ("SELECT * FROM team_result WHERE match_id = 1", "ix_team_result_match_id"),
+        ("SELECT * FROM team_result WHERE team_id = 1", "ix_team_result_team_id"),
+        ("SELECT * FROM match WHERE game_id = 1", "ix_match_game_id"),
+        ("SELECT * FROM match WHERE map_id = 1", "ix_match_map_id"),
+        ("SELECT * FROM match WHERE ruleset_id = 1", "ix_match_ruleset_id"),
+        ("SELECT * FROM match ORDER BY date, id LIMIT 50", "ix_match_date"),
+        ("SELECT * FROM map WHERE game_id = 1", "ix_map_game_id"),
+        ("SELECT * FROM api_key WHERE player_id = 1", "ix_api_key_player_id"),
+    ]
+
+    @staticmethod
+    def _plan(sql):
+        """
+        EXPLAIN QUERY PLAN of a statement as one string
+        """
+        rows = db.session.execute(db.text("EXPLAIN QUERY PLAN " + sql))
+        return " ".join(row[-1] for row in rows)
+
+    def test_query_plans(self, client):
+        """
+        Every query searches its index and sorting needs no temp B-tree
+        """
+        with client.application.app_context():
+            for sql, index in self.QUERIES:
+                plan = self._plan(sql)
+                assert index in plan, plan
+                assert "TEMP B-TREE" not in plan, plan
+
+    def test_upgrade(self, client):
+        """
+        init-db --upgrade adds indexes and columns an old database is missing
+        """
+        app = client.application
+        with app.app_context():
+            db.session.execute(db.text("DROP INDEX ix_player_result_match_id"))
+            db.session.execute(db.text("ALTER TABLE player DROP COLUMN match_count"))
+            db.session.commit()
+
+        result = app.test_cli_runner().invoke(args=["init-db", "--upgrade"])
+        assert result.exit_code == 0
+        assert "ix_player_result_match_id" in result.output
+        assert "player.match_count" in result.output
+
+        with app.app_context():
+            assert "ix_player_result_match_id" in self._plan(self.QUERIES[0][0])
+            assert db.session.get(Player, 1).match_count == 1
+        result = app.test_cli_runner().invoke(args=["init-db", "--upgrade"])
+        assert result.output == ""
+
+class TestSqlitePragmas():
+    """
+    Test the SQLite profile set on connect
+    """
+
+    def test_pragmas(self, client):
+        """
+        Every connection gets the PRAGMAs of SQLITE_PRAGMAS and readers
+        see the last commit while a write is open
+        """
+        with client.application.app_context():
+            with db.engine.connect() as writer, db.engine.connect() as reader:
+                pragma = lambda name: reader.exec_driver_sql(f"PRAGMA {name}").scalar()
+                assert pragma("journal_mode") == "wal"
+                assert pragma("synchronous") == 1
+                assert pragma("temp_store") == 2
+                assert pragma("cache_size") == -64000
+                assert pragma("busy_timeout") == 5000
+                assert pragma("foreign_keys") == 1
+
+                writer.exec_driver_sql("BEGIN IMMEDIATE")
+                writer.exec_driver_sql("INSERT INTO player (name) VALUES ('John-4')")
+                count = "SELECT count(*) FROM player"
+                assert reader.exec_driver_sql(count).scalar() == 3
+                writer.exec_driver_sql("COMMIT")
+
+class TestImport():
+    """
+    Test flask import
+    """
+
+    CSV = (
+        "match,date,turns,game,map,ruleset,player,team,points,order\n"
+        "a,2021-05-01T18:00:00,40,CS:GO,dust,competitive,John-1,alpha,10,\n"
+        "a,2021-05-01T18:00:00,40,CS:GO,dust,competitive,Newbie,alpha,12,\n"
+        "a,2021-05-01T18:00:00,40,CS:GO,dust,competitive,,alpha,22,1\n"
+        "b,2021-05-02T18:00:00,20,Chess,,,John-1,,1,\n"
+    )
+
+    def _import(self, client, name, content, *args):
+        """
+        Write content to a file and import it
+        """
+        path = os.path.join(tempfile.mkdtemp(), name)
+        with open(path, "w", encoding="utf-8") as handle:
+            handle.write(content)
+        return client.application.test_cli_runner().invoke(args=["import", path, *args])
+
+    def test_import_csv(self, client):
+        """
+        Matches and results come in, names are matched and new ones added
+        """
+        result = self._import(client, "history.csv", self.CSV, "--batch-size", "2")
+        assert result.exit_code == 0, result.output
+        assert "Imported 2 matches with 4 results" in result.output
+
+        players, teams, games = _match_counts(client)
+        assert players["John-1"] == 3
+        assert players["Newbie"] == 1
+        assert teams["alpha"] == 2
+        assert games["Chess"] == 1
+
+        body = json.loads(client.get("/api/player/Newbie/").data)
+        assert body["matches"][0]["map_name"] == "dust"
+        with client.application.app_context():
+            assert Map.query.filter_by(name="dust").count() == 1
+
+    def test_import_ndjson(self, client):
+        """
+        Same rows as NDJSON, a broken row stops the import
+        """
+        rows = [dict(zip(self.CSV.splitlines()[0].split(","), line.split(",")))
+                for line in self.CSV.splitlines()[1:]]
+        content = "\n".join(json.dumps(row) for row in rows)
+        result = self._import(client, "history.ndjson", content)
+        assert result.exit_code == 0, result.output
+        assert "Imported 2 matches with 4 results" in result.output
+
+        result = self._import(client, "broken.ndjson", json.dumps(dict(rows[0], date="soon")))
+        assert result.exit_code != 0
+        assert "Line 1" in result.output
+
+        result = self._import(client, "broken.ndjson", json.dumps(rows[0]) + "\n{broken\n")
+        assert result.exit_code == 1
+        assert "Line 2" in result.output
+        assert "JSONDecodeError" in result.output
+
+class TestTestgen():
+    """
+    Test flask testgen with size options
+    """
+
+    def test_sizes(self, client):
+        """
+        Given sizes are added, counters agree with a recount and the
+        same seed gives the same data
+        """
+        app = client.application
+        args = ["testgen", "--players", "30", "--teams", "4", "--games", "3",
+                "--matches", "200", "--results-per-match", "5", "--seed", "7"]
+        result = app.test_cli_runner().invoke(args=args)
+        assert result.exit_code == 0, result.output
+
+        with app.app_context():
+            assert Player.query.count() == 3 + 30
+            assert Match.query.count() == 2 + 200
+            assert PlayerResult.query.filter(PlayerResult.match_id > 2).count() == 200 * 5
+            assert TeamResult.query.filter(TeamResult.match_id > 2).count() == 200 * 2
+
+        counts = _match_counts(client)
+        app.test_cli_runner().invoke(args=["recount"])
+        assert _match_counts(client) == counts
+
+        # second run adds new rows, but the same dates and turns
+        app.test_cli_runner().invoke(args=args)
+        with app.app_context():
+            matches = [(m.date, m.turns) for m in Match.query.filter(Match.id > 2).order_by(Match.id)]
+        assert matches[:200] == matches[200:]
+
+    @pytest.mark.parametrize("option", ["--players", "--games", "--maps-per-game"])
+    def test_zero_sizes(self, client, option):
+        """
+        Sizes that cannot make a data set are usage errors, not tracebacks
+        """
+        result = client.application.test_cli_runner().invoke(args=["testgen", option, "0"])
+        assert result.exit_code == 2
+        assert "Invalid value" in result.output
+
+        result = client.application.test_cli_runner().invoke(
+            args=["testgen", "--teams", "0", "--matches", "3", "--results-per-match", "0"]
+        )
+        assert result.exit_code == 0, result.output
+
+class TestCacheInvalidation():
+    """
+    Test that writes drop the cached collection views
+    """
+
+    def test_cached_until_write(self, client):
+        """
+        Second GET comes from the cache, a POST makes the next GET fresh
+        """
+        resp = client.get("/api/players/")
+        assert len(json.loads(resp.data)["items"]) == 3
+
+        statements = []
+        with client.application.app_context():
+            engine = db.engine
+
+        def _count(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(engine, "before_cursor_execute", _count)
+        try:
+            resp = client.get("/api/players/")
+        finally:
+            event.remove(engine, "before_cursor_execute", _count)
+        assert resp.status_code == 200
+        assert statements == []
+
+        resp = client.post("/api/players/", json=_get_player_json())
+        assert resp.status_code == 201
+        resp = client.get("/api/players/")
+        assert len(json.loads(resp.data)["items"]) == 4
+
+    def test_child_write_drops_parent_view(self, client):
+        """
+        New result changes the player's match count in the player list
+        """
+        resp = client.get("/api/players/")
+        counts = {item["name"]: item["matches"] for item in json.loads(resp.data)["items"]}
+        assert counts["John-2"] == 0
+        resp = client.post("/api/match/1/playerresults/",
+                           json={"points": 5, "player_id": 2, "team_id": 2})
+        assert resp.status_code == 201
+        resp = client.get("/api/players/")
+        counts = {item["name"]: item["matches"] for item in json.loads(resp.data)["items"]}
+        assert counts["John-2"] == 1
+
+    def test_recount_drops_views(self, client):
+        """
+        flask recount changes the ETag and the body of cached views
+        """
+        app = client.application
+        with app.app_context():
+            db.session.execute(db.update(Player).values(match_count=7))
+            db.session.commit()
+        resp = client.get("/api/players/")
+        etag = resp.headers["ETag"]
+        assert json.loads(resp.data)["items"][1]["matches"] == 7
+
+        result = app.test_cli_runner().invoke(args=["recount"])
+        assert result.exit_code == 0
+        resp = client.get("/api/players/", headers=Headers({"If-None-Match": etag}))
+        assert resp.status_code == 200
+        assert resp.headers["ETag"] != etag
+        assert json.loads(resp.data)["items"][1]["matches"] == 0
+
+    def test_rename_drops_map_list(self, client):
+        """
+        Renamed map shows up in the cached map list right away
+        """
+        resp = client.get("/api/game/CS:GO/maps/")
+        assert "dust" in [item["name"] for item in json.loads(resp.data)["items"]]
+        resp = client.put("/api/game/CS:GO/map/1/", json=_get_map_json())
+        assert resp.status_code == 204
+        resp = client.get("/api/game/CS:GO/maps/")
+        assert "newmap" in [item["name"] for item in json.loads(resp.data)["items"]]
+
+class TestConditionalGet():
+    """
+    Test ETag and If-None-Match
+    """
+
+    @pytest.mark.parametrize("url", [
+        "/api/players/",
+        "/api/matches/",
+        "/api/match/1/",
+        "/api/player/John-1/",
+        "/api/game/CS:GO/",
+        "/api/game/CS:GO/map/1/",
+        "/api/match/1/playerresults/",
+    ])
+    def test_not_modified(self, client, url):
+        """
+        Same ETag gives 304 with no body
+        """
+        resp = client.get(url)
+        assert resp.status_code == 200
+        etag = resp.headers["ETag"]
+        resp = client.get(url, headers=Headers({"If-None-Match": etag}))
+        assert resp.status_code == 304
+        assert resp.data == b""
+        assert resp.headers["ETag"] == etag
+
+    def test_write_changes_etag(self, client):
+        """
+        A write to a table the view reads gives a new ETag
+        """
+        resp = client.get("/api/match/1/")
+        etag = resp.headers["ETag"]
+        resp = client.post("/api/match/1/playerresults/",
+                           json={"points": 5, "player_id": 2, "team_id": 2})
+        assert resp.status_code == 201
+        resp = client.get("/api/match/1/", headers=Headers({"If-None-Match": etag}))
+        assert resp.status_code == 200
+        assert resp.headers["ETag"] != etag
+        assert len(json.loads(resp.data)["player_results"]) == 2
+
+    def test_pages_have_own_etags(self, client):
+        """
+        Different query string, different ETag
+        """
+        client.application.config["PAGE_SIZE"] = 1
+        resp = client.get("/api/matches/")
+        next_href = json.loads(resp.data)["@controls"]["next"]["href"]
+        resp2 = client.get(next_href, headers=Headers({"If-None-Match": resp.headers["ETag"]}))
+        assert resp2.status_code == 200
+
+class TestValidators():
+    """
+    Test the precompiled request validators
+    """
+
+    def test_same_errors_as_validate(self):
+        """
+        validate_json fails like jsonschema.validate did
+        """
+        for model, instance in ((Player, {"name": 123}),
+                                (Match, {"date": "2022-12-25"}),
+                                (PlayerResult, {"points": "x", "player_id": 1})):
+            with pytest.raises(ValidationError) as compiled:
+                validate_json(instance, model)
+            with pytest.raises(ValidationError) as plain:
+                validate(instance, model.get_schema())
+            assert str(compiled.value) == str(plain.value)
+        validate_json(_get_player_json(), Player)
+
+    def test_shared_controls(self, client):
+        """
+        Schemas and collection controls are built once and still
+        come out the same as before
+        """
+        assert model_schema(PlayerResult) is model_schema(PlayerResult)
+        for _ in range(2):
+            body = json.loads(client.get("/api/match/1/").data)
+            assert body["@namespaces"]["BGT"]["name"]
+            assert body["@controls"]["edit"]["schema"] == Match.get_schema()
+            assert body["@controls"]["BGT:all-matches"]["href"] == "/api/matches/"
+            for row in body["player_results"]:
+                assert row["@controls"]["edit"]["schema"] == PlayerResult.get_schema()
+        body = json.loads(client.get("/api/players/").data)
+        assert body["@controls"]["BGT:add-player"]["schema"] == Player.get_schema()
+
+    @pytest.mark.parametrize("fallback", [False, True])
+    def test_fragment_splice(self, client, monkeypatch, fallback):
+        """
+        Shared pieces are spliced in with orjson and with stdlib json,
+        strings that only look like placeholders are left alone
+        """
+        if fallback:
+            monkeypatch.setattr(utils, "orjson", None)
+            monkeypatch.setattr(utils, "ujson", None)
+        with client.application.test_request_context():
+            body = BGTBuilder()
+            body.add_control_add_player()
+            body["items"] = [{"schema": model_schema(Team), "name": "bgt-fragment-0"}]
+            data = utils.encode_json(body)
+        assert utils._FRAGMENT_PREFIX.encode() not in data
+        decoded = json.loads(data)
+        assert decoded["@controls"]["BGT:add-player"]["schema"] == Player.get_schema()
+        assert decoded["items"] == [{"schema": Team.get_schema(), "name": "bgt-fragment-0"}]
+
+class TestUrlTemplate():
+    """
+    Test the prebuilt item hrefs
+    """
+
+    def test_same_as_url_for(self, client):
+        """
+        Templates give what url_for gives, also under a script root
+        """
+        app = client.application
+        with app.app_context():
+            player = Player(name="John Doe/2")
+            game = Game.query.first()
+            map_ = Map.query.first()
+            for base_url in ("http://localhost/", "http://localhost/root/"):
+                with app.test_request_context(base_url=base_url):
+                    assert url_template("api.playeritem", "player")(player=player) \
+                        == url_for("api.playeritem", player=player)
+                    assert url_template("api.mapitem", "game", "map_")(game=game, map_=map_) \
+                        == url_for("api.mapitem", game=game, map_=map_)
+                    # query arguments go to url_for
+                    assert url_template("api.matchcollection", "after")(after="x") \
+                        == url_for("api.matchcollection", after="x")
+
+class TestTwoTierCache():
+    """
+    Test the in-memory tier in front of another cache
+    """
+
+    def test_tiers(self):
+        """
+        Hits come from memory first, then from the backend
+        """
+        backend = SimpleCache()
+        two_tier = TwoTierCache(backend, memory_threshold=2)
+        two_tier.set("view/a", {"a": 1})
+        assert two_tier.get("view/a") == {"a": 1}
+        assert two_tier.stats()["memory"]["hits"] == 1
+
+        # every hit is a copy
+        two_tier.get("view/a")["a"] = 2
+        assert two_tier.get("view/a") == {"a": 1}
+
+        # LRU drops "view/a", the backend still has it
+        two_tier.set("view/b", 2)
+        two_tier.set("view/c", 3)
+        assert two_tier.stats()["memory"]["size"] == 2
+        assert two_tier.get("view/a") == {"a": 1}
+        stats = two_tier.stats()
+        assert stats["memory"]["misses"] == 1
+        assert stats["filesystem"]["hits"] == 1
+
+        assert two_tier.get("view/missing") is None
+        assert two_tier.stats()["filesystem"]["misses"] == 1
+
+        two_tier.delete("view/a")
+        assert two_tier.get("view/a") is None
+        assert backend.get("view/a") is None
+
+    def test_bypass(self):
+        """
+        Versions are always read from the shared backend
+        """
+        backend = SimpleCache()
+        two_tier = TwoTierCache(backend)
+        two_tier.set("version/player", "abc")
+        backend.set("version/player", "def")
+        assert two_tier.get("version/player") == "def"
+        assert two_tier.stats()["memory"]["size"] == 0
+
+    def test_app_cache(self, tmp_path):
+        """
+        The default app config uses the two tier cache
+        """
+        app = create_app({
+            "SQLALCHEMY_DATABASE_URI": "sqlite://",
+            "CACHE_DIR": str(tmp_path),
+        })
+        with app.app_context():
+            cache.set("view/x", "y")
+            assert isinstance(cache.cache, TwoTierCache)
+            assert cache.get("view/x") == "y"
+            assert cache.cache.stats()["memory"]["hits"] == 1
+
+    def test_versions_survive_pruning(self, tmp_path):
+        """
+        A full cache drops views, not the table versions
+        """
+        app = create_app({
+            "SQLALCHEMY_DATABASE_URI": "sqlite://",
+            "CACHE_TYPE": "boardgametracker.caching.two_tier",
+            "CACHE_DIR": str(tmp_path),
+            "CACHE_THRESHOLD": 5,
+        })
+        with app.test_request_context():
+            version = table_versions(["player"])
+        with app.test_request_context():
+            for i in range(20):
+                cache.set(f"view/{i}", i)
+        with app.test_request_context():
+            assert table_versions(["player"]) == version
+
+class TestInstrumentation():
+    """
+    Test the Server-Timing headers and stats of INSTRUMENTATION
+    """
+
+    def test_server_timing(self, instrumented_client):
+        """
+        Queries of the converters and the view are counted
+        """
+        resp = instrumented_client.get("/api/match/1/")
+        assert resp.status_code == 200
+        timing = resp.headers["Server-Timing"]
+        assert timing.startswith("db;dur=")
+        assert '"3 queries"' in timing
+        assert "serialize;dur=" in timing
+        assert "total;dur=" in timing
+
+    def test_stats(self, instrumented_client):
+        """
+        Requests are summed per endpoint, only admins can read them
+        """
+        for _ in range(3):
+            instrumented_client.get("/api/players/")
+        resp = instrumented_client.get("/api/_stats/")
+        assert resp.status_code == 200
+        stats = json.loads(resp.data)["endpoints"]["api.playercollection"]
+        assert stats["requests"] == 3
+        assert stats["max_queries"] >= 1
+        assert stats["total_ms"] >= stats["db_ms"]
+
+        assert sum(stats["latency_buckets"]) == 3
+        assert len(stats["latency_buckets"]) == len(LATENCY_BUCKETS_MS) + 1
+
+        body = json.loads(resp.data)
+        assert body["cache"] is None
+        assert body["db_pool"]["checkouts"] >= 3
+        slow = body["slow_queries"][0]
+        assert slow["endpoint"] == "api.playercollection"
+        assert slow["statement"].startswith("SELECT")
+
+        plain = FlaskClient(instrumented_client.application,
+                            instrumented_client.application.response_class)
+        assert plain.get("/api/_stats/").status_code == 403
+        assert plain.get("/api/_stats/?format=prometheus").status_code == 403
+
+    def test_prometheus(self, instrumented_client):
+        """
+        Histogram buckets are cumulative and end with +Inf
+        """
+        for _ in range(2):
+            instrumented_client.get("/api/players/")
+        resp = instrumented_client.get("/api/_stats/?format=prometheus")
+        assert resp.status_code == 200
+        assert resp.content_type.startswith("text/plain")
+        lines = resp.data.decode().splitlines()
+        label = 'endpoint="api.playercollection"'
+        buckets = [line for line in lines
+                   if line.startswith("bgt_request_duration_seconds_bucket{" + label)]
+        counts = [int(line.rsplit(" ", 1)[1]) for line in buckets]
+        assert counts == sorted(counts)
+        assert buckets[-1] == f'bgt_request_duration_seconds_bucket{{{label},le="+Inf"}} 2'
+        assert f"bgt_request_duration_seconds_count{{{label}}} 2" in lines
+        assert "# TYPE bgt_db_pool_checkouts_total counter" in lines
+
+    def test_cache_hit_ratio(self, tmp_path):
+        """
+        Hit ratios of the two tier cache
+        """
+        db_fd, test_client = _make_client(
+            INSTRUMENTATION=True,
+            CACHE_TYPE="boardgametracker.caching.two_tier",
+            CACHE_DIR=str(tmp_path),
+        )
+        test_client.get("/api/players/")
+        test_client.get("/api/players/")
+        body = json.loads(test_client.get("/api/_stats/").data)
+        assert body["cache"]["memory"]["hits"] >= 1
+        assert 0 < body["cache"]["memory"]["hit_ratio"] < 1
+        os.close(db_fd)
+
+    def test_failed_statements(self, instrumented_client):
+        """
+        Statements that fail are counted and leave nothing on the connection
+        """
+        player = dict(_get_player_json(), name="John-1")
+        for _ in range(3):
+            resp = instrumented_client.post("/api/players/", json=player)
+            assert resp.status_code == 409
+        with instrumented_client.application.app_context():
+            with db.engine.connect() as connection:
+                assert not connection.info.get("query_start")
+        stats = json.loads(instrumented_client.get("/api/_stats/").data)["endpoints"]
+        assert stats["api.playercollection"]["max_queries"] >= 1
+
+    def test_off_by_default(self, client):
+        """
+        No headers and no stats endpoint without the config
+        """
+        resp = client.get("/api/players/")
+        assert "Server-Timing" not in resp.headers
+        assert client.get("/api/_stats/").status_code == 404
+
+class TestSlowRequestProfiler():
+    """
+    Test the profiles of SLOW_REQUEST_PROFILE_MS
+    """
+
+    def test_profiles(self):
+        """
+        Slow requests keep their top frames, only admins can download them
+        """
+        reset_stats()
+        db_fd, test_client = _make_client(SLOW_REQUEST_PROFILE_MS=0)
+        assert test_client.get("/api/game/CS:GO/").status_code == 200
+        resp = test_client.get("/api/_stats/profiles/")
+        assert resp.status_code == 200
+        assert resp.headers["Content-Disposition"].startswith("attachment")
+        profile = json.loads(resp.data)["profiles"][0]
+        assert profile["endpoint"] == "api.gameitem"
+        assert profile["path"] == "/api/game/CS:GO/?"
+        assert 0 < len(profile["frames"]) <= 30
+        frame = profile["frames"][0]
+        assert frame["cumulative_ms"] >= frame["own_ms"]
+
+        plain = FlaskClient(test_client.application, test_client.application.response_class)
+        assert plain.get("/api/_stats/profiles/").status_code == 403
+        os.close(db_fd)
+
+    def test_fast_requests(self):
+        """
+        Requests under the threshold are not kept, no endpoint when off
+        """
+        reset_stats()
+        db_fd, test_client = _make_client(SLOW_REQUEST_PROFILE_MS=60000)
+        test_client.get("/api/game/CS:GO/")
+        resp = test_client.get("/api/_stats/profiles/")
+        assert json.loads(resp.data)["profiles"] == []
+        os.close(db_fd)
+
+        db_fd, test_client = _make_client()
+        assert test_client.get("/api/_stats/profiles/").status_code == 404
+        os.close(db_fd)
+
 class TestIndex():
     """
     Test for Index